@@ -0,0 +1,343 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUBS = os.path.join(REPO, "benchmarks", "stubs")
+FIXTURES = os.path.join(REPO, "benchmarks", "fixtures")
+RECEPTOR = os.path.join(FIXTURES, "receptor.pdb")
+LIGAND = os.path.join(FIXTURES, "ligand.sdf")
+BASELINE = os.path.join(REPO, "benchmarks", "baseline.json")
+
+# the vina stub shadows the bindings, here and in the spawned docking workers
+sys.path[:0] = [STUBS, REPO]
+os.environ["PYTHONPATH"] = os.pathsep.join([STUBS, REPO, os.environ.get("PYTHONPATH", "")])
+
+from pocketgen_stub import StubPocketGen, collate
+
+try:
+  import resource
+except ImportError: # not available on Windows
+  resource = None
+
+BENCHMARKS = {}
+
+class Skip(Exception):
+  """
+  Raised by a benchmark whose dependencies are missing from this environment.
+  """
+
+
+def benchmark(name:str):
+  """
+  Registers a benchmark. The decorated function receives a scratch directory
+  and returns the timed callable, and optionally a setup callable run before
+  each repeat, outside of the measure, whose result is passed to the first one.
+  @param name (str): the benchmark name, used in the results and baselines.
+  """
+
+  def register(function):
+    BENCHMARKS[name] = function
+    return function
+  return register
+
+
+def mutants(workdir:str, n:int=16) -> "list[str]":
+  """
+  Writes mutants of the fixture receptor, as the PocketGen stub generates them.
+  @param workdir (str): the directory the mutants are written into.
+  @param n (int): the number of mutants.
+  @return (list[str]): the mutant PDB paths.
+  """
+
+  random.seed(0)
+  StubPocketGen().generate({"samples": [{"protein_filename": RECEPTOR, "ligand_filename": LIGAND}] * n}, workdir)
+  return [os.path.join(workdir, f"{i}_whole.pdb") for i in range(n)]
+
+
+def stub_model(output:str, number:int=8):
+  """
+  Builds a CPU Model whose PocketGen network is replaced by the stub.
+  @param output (str): the output directory.
+  @param number (int): the number of mutants per run.
+  @return (Model): the model, with docking cache disabled.
+  """
+
+  try:
+    from model.Model import Model
+  except ImportError as e:
+    raise Skip(f"model.Model cannot be imported ({e})")
+
+  flint = Model(os.path.join(REPO, "checkpoints", "checkpoint.pt"), {
+    "device": "cpu",
+    "output": output,
+    "verbose": 0,
+    "number": number,
+    "batch_size": 4,
+    "cache_size": 0
+  })
+  flint._model = StubPocketGen()
+  flint.collate = collate
+  return flint
+
+
+def require_openbabel() -> None:
+  try:
+    import openbabel
+  except ImportError:
+    if shutil.which("obabel") is None:
+      raise Skip("Open Babel is not installed")
+
+
+@benchmark("compute_box")
+def bench_compute_box(workdir:str):
+  try:
+    from eval.window import compute_box
+  except ImportError as e:
+    raise Skip(str(e))
+  return lambda _: compute_box(RECEPTOR, LIGAND), None
+
+
+@benchmark("compute_boxes")
+def bench_compute_boxes(workdir:str):
+  try:
+    from eval.window import compute_boxes
+  except ImportError as e:
+    raise Skip(str(e))
+  receptors = mutants(workdir)
+  return lambda _: compute_boxes(receptors, LIGAND), None
+
+
+@benchmark("mutations")
+def bench_mutations(workdir:str):
+  from eval.mutations import mutations_batch
+  receptors = mutants(workdir)
+  return lambda _: mutations_batch(RECEPTOR, receptors), None
+
+
+@benchmark("prepare")
+def bench_prepare(workdir:str):
+  require_openbabel()
+  from eval.prepare import prepare_all
+
+  # converted files are up to date after a repeat, each one gets new copies
+  def setup():
+    directory = tempfile.mkdtemp(dir=workdir)
+    return mutants(directory, 4) + [shutil.copy(LIGAND, directory)]
+
+  return prepare_all, setup
+
+
+@benchmark("interaction")
+def bench_interaction(workdir:str):
+  try:
+    from model.sampler import interaction
+  except ImportError as e:
+    raise Skip(str(e))
+  return lambda _: interaction(RECEPTOR, LIGAND), None
+
+
+@benchmark("interaction_cached")
+def bench_interaction_cached(workdir:str):
+  try:
+    from model.sampler import interaction
+  except ImportError as e:
+    raise Skip(str(e))
+  interaction(RECEPTOR, LIGAND, cachedir=workdir)
+  return lambda _: interaction(RECEPTOR, LIGAND, cachedir=workdir), None
+
+
+@benchmark("densify")
+def bench_densify(workdir:str):
+  try:
+    import copy
+    import model.sampler as sampler
+  except ImportError as e:
+    raise Skip(str(e))
+
+  # catches the features interaction() hands to densify
+  captured = []
+  densify = sampler.densify
+  sampler.densify = lambda features: captured.append(copy.deepcopy(features)) or densify(features)
+  try:
+    sampler.interaction(RECEPTOR, LIGAND)
+  finally:
+    sampler.densify = densify
+
+  return densify, lambda: copy.deepcopy(captured[0])
+
+
+@benchmark("affinity")
+def bench_affinity(workdir:str):
+  try:
+    from eval.affinity import pad, statistics
+  except ImportError as e:
+    raise Skip(str(e))
+
+  # a large run, 32 poses per docking
+  random.seed(0)
+  energies = pad([[random.uniform(-9, -3) for _ in range(32)] for _ in range(4096)])
+  return lambda _: statistics(energies), None
+
+
+@benchmark("results")
+def bench_results(workdir:str):
+  require_openbabel()
+
+  # every repeat scores a new run of 8 mutants
+  def setup():
+    flint = stub_model(tempfile.mkdtemp(dir=workdir))
+    return flint.input(RECEPTOR, LIGAND).generate()
+
+  return lambda flint: flint.results(), setup
+
+
+@benchmark("end_to_end")
+def bench_end_to_end(workdir:str):
+  require_openbabel()
+  stub_model(tempfile.mkdtemp(dir=workdir)) # fails early when the model cannot be built
+
+  def run(output):
+    stub_model(output).input(RECEPTOR, LIGAND).generate().results()
+
+  return run, lambda: tempfile.mkdtemp(dir=workdir)
+
+
+def measure(name:str, repeat:int) -> dict:
+  """
+  Runs a benchmark repeat times, then once more under tracemalloc, so that
+  allocation tracing does not slow the timed repeats down.
+  @param name (str): the benchmark name.
+  @param repeat (int): the number of timed repeats.
+  @return (dict): wall and CPU times in seconds, python allocations and RSS peaks
+  in megabytes, or the reason the benchmark was skipped.
+  """
+
+  with tempfile.TemporaryDirectory() as workdir:
+    try:
+      run, setup = BENCHMARKS[name](workdir)
+    except Skip as e:
+      return {"skipped": str(e)}
+    setup = setup or (lambda: None)
+
+    walls, cpus = [], []
+    for _ in range(repeat):
+      state = setup()
+      start, cpu = time.perf_counter(), time.process_time()
+      run(state)
+      walls.append(time.perf_counter() - start)
+      cpus.append(time.process_time() - cpu)
+
+    state = setup()
+    tracemalloc.start()
+    run(state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+  return {
+    "repeat": repeat,
+    "wall_min": min(walls),
+    "wall_median": statistics.median(walls),
+    "cpu_median": statistics.median(cpus),
+    "peak_alloc_mb": peak / 2 ** 20,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None
+  }
+
+
+def compare(results:dict, baseline:dict, tolerance:float) -> "list[str]":
+  """
+  Compares the median wall times and allocation peaks with a baseline.
+  @param results (dict): the benchmarks of this run.
+  @param baseline (dict): the benchmarks of the baseline.
+  @param tolerance (float): the relative slowdown or growth allowed (0.25 is 25%).
+  @return (list[str]): the regressions found.
+  """
+
+  regressions = []
+  for name, current in results.items():
+    previous = baseline.get(name)
+    if previous is None or "skipped" in current or "skipped" in previous:
+      continue
+
+    for metric in ("wall_median", "peak_alloc_mb"):
+      if previous[metric] > 0 and current[metric] > previous[metric] * (1 + tolerance):
+        regressions.append(f"{name} {metric} : {previous[metric]:.4g} -> {current[metric]:.4g} "
+          f"({100 * (current[metric] / previous[metric] - 1):+.0f}%)")
+      current[f"{metric}_ratio"] = current[metric] / previous[metric] if previous[metric] > 0 else None
+  return regressions
+
+
+def metadata() -> dict:
+  try:
+    commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO, capture_output=True, text=True).stdout.strip()
+  except OSError:
+    commit = None
+
+  return {
+    "time": time.time(),
+    "commit": commit,
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "cpus": os.cpu_count()
+  }
+
+
+def report(results:dict) -> str:
+  lines = [f"{'benchmark':<22}{'median (s)':>12}{'min (s)':>12}{'cpu (s)':>12}{'alloc (MB)':>12}{'vs baseline':>13}"]
+  for name, result in results.items():
+    if "skipped" in result:
+      lines.append(f"{name:<22}skipped : {result['skipped']}")
+      continue
+    ratio = result.get("wall_median_ratio")
+    ratio = f"{ratio:.2f}x" if ratio is not None else "-"
+    lines.append(f"{name:<22}{result['wall_median']:>12.4f}{result['wall_min']:>12.4f}"
+      f"{result['cpu_median']:>12.4f}{result['peak_alloc_mb']:>12.2f}{ratio:>13}")
+  return "\n".join(lines)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Times and memory-profiles the Flint pipeline stages on the bundled fixtures.")
+  parser.add_argument("-r", "--repeat", type=int, default=5, help="Set the number of timed repeats of each benchmark")
+  parser.add_argument("-k", "--only", type=str, nargs="+", choices=list(BENCHMARKS), default=None, help="Set the benchmarks to run")
+  parser.add_argument("--json", type=str, default=None, help="Set the path of the machine-readable results")
+  parser.add_argument("--baseline", type=str, default=BASELINE, help="Set the baseline the results are compared with")
+  parser.add_argument("--save-baseline", action='store_true', help="Write the results as the new baseline")
+  parser.add_argument("--no-baseline", action='store_true', help="Only report the results, without comparing them with a baseline")
+  parser.add_argument("--tolerance", type=float, default=0.25, help="Set the relative slowdown reported as a regression")
+  args = parser.parse_args()
+
+  # a missing baseline would let every regression through
+  if not (args.save_baseline or args.no_baseline or os.path.isfile(args.baseline)):
+    parser.error(f"no baseline at {args.baseline}, record one on this machine with --save-baseline, or pass --no-baseline")
+
+  # Model reads the PocketGen config relatively to the repository
+  os.chdir(REPO)
+
+  results = {name: measure(name, args.repeat) for name in args.only or BENCHMARKS}
+
+  regressions = []
+  if not (args.save_baseline or args.no_baseline):
+    with open(args.baseline, "r") as file:
+      regressions = compare(results, json.load(file)["benchmarks"], args.tolerance)
+
+  print(report(results))
+  output = {"meta": metadata(), "benchmarks": results, "regressions": regressions}
+
+  for path in (args.json, args.baseline if args.save_baseline else None):
+    if path:
+      with open(path, "w") as file:
+        json.dump(output, file, indent=2)
+
+  if regressions:
+    print("\nRegressions over the baseline :")
+    print("\n".join(f"\t{regression}" for regression in regressions))
+    sys.exit(1)
@@ -0,0 +1,55 @@
+import os
+import random
+import shutil
+
+from eval.mutations import AMINO_ACIDS
+
+RESIDUES = sorted(AMINO_ACIDS)
+
+def collate(features:"list[dict]") -> dict:
+  """
+  Replaces the PocketGen collate function, the stub only needs the samples.
+  @param features (list[dict]): the features of each sample of the batch.
+  @return (dict): the batch.
+  """
+
+  return {"samples": features}
+
+
+class StubPocketGen:
+  def __init__(self, mutations:int=3):
+    """
+    Stand-in for Pocket_Design_new : each sample of a batch is written as a
+    copy of its receptor with a few residues renamed, and a copy of its ligand,
+    with the file names of PocketGen, numbered by a counter kept over batches. 
+    Mutations are drawn from the python random generator, which Model seeds 
+    for each batch.
+    @param mutations (int): the number of mutated residues per sample.
+    """
+
+    self.mutations = mutations
+    self.count = 0
+
+
+  def eval(self) -> "StubPocketGen":
+    return self
+
+
+  def generate(self, batch:dict, target_path:str) -> None:
+    os.makedirs(target_path, exist_ok=True)
+
+    for features in batch["samples"]:
+      i, self.count = self.count, self.count + 1
+      with open(features["protein_filename"], "r") as file:
+        lines = file.readlines()
+
+      residues = sorted({line[21:27] for line in lines if line.startswith("ATOM")})
+      renamed = {residue: random.choice(RESIDUES) for residue in random.sample(residues, self.mutations)}
+
+      with open(os.path.join(target_path, f"{i}_whole.pdb"), "w") as file:
+        for line in lines:
+          if line.startswith("ATOM") and line[21:27] in renamed:
+            line = line[:17] + renamed[line[21:27]] + line[20:]
+          file.write(line)
+
+      shutil.copyfile(features["ligand_filename"], os.path.join(target_path, f"{i}.sdf"))
@@ -0,0 +1,58 @@
+import hashlib
+
+class Vina:
+  def __init__(self, sf_name:str="vina", cpu:int=0, seed:int=0, verbosity:int=1):
+    """
+    Stand-in for the AutoDock Vina bindings, with the same calls as eval.docking.
+    Energies are derived from the content of the docked files, so that they are
+    deterministic and differ between mutants, and maps cost a pass over the atoms.
+    """
+
+    self.seed = seed
+    self.receptor = b""
+    self.ligand = b""
+    self.atoms = 0
+
+
+  def set_receptor(self, rigid_pdbqt_filename:str) -> None:
+    with open(rigid_pdbqt_filename, "rb") as file:
+      self.receptor = file.read()
+
+
+  def set_ligand_from_file(self, pdbqt_filename:str) -> None:
+    with open(pdbqt_filename, "rb") as file:
+      self.ligand = file.read()
+
+
+  def set_ligand_from_string(self, pdbqt_string:str) -> None:
+    self.ligand = pdbqt_string.encode()
+
+
+  def compute_vina_maps(self, center=(0, 0, 0), box_size=(20, 20, 20)) -> None:
+    self.atoms = sum(1 for line in self.receptor.splitlines() if line.startswith((b"ATOM", b"HETATM")))
+
+
+  def score(self) -> "list[float]":
+    return [self._energy(0)]
+
+
+  def optimize(self) -> "list[float]":
+    return [self._energy(0) - 0.5]
+
+
+  def dock(self, exhaustiveness:int=8, n_poses:int=20) -> None:
+    self.poses = n_poses
+
+
+  def energies(self, n_poses:int=9) -> "list[list[float]]":
+    return [[self._energy(pose)] for pose in range(n_poses)]
+
+
+  def write_poses(self, pdbqt_filename:str, n_poses:int=9, overwrite:bool=False) -> None:
+    with open(pdbqt_filename, "wb") as file:
+      file.write(self.ligand)
+
+
+  def _energy(self, pose:int) -> float:
+    digest = hashlib.sha256(self.receptor + self.ligand + bytes([self.seed % 256])).digest()
+    return -4.0 - digest[0] / 64 + 0.25 * pose
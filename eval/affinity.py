@@ -0,0 +1,115 @@
+import os
+import warnings
+import numpy as np
+
+R = 0.001987 # gaz constant (kcal/mol/K)
+
+STATISTICS = ("mean", "boltzmann", "min", "median")
+
+def kd(delta_G:np.ndarray, temperature:float=298.0) -> np.ndarray:
+  """
+  calculates the affinity constants of an array of binding free energies, see chemutils.kd
+  @param delta_G (np.ndarray): the binding free energies (kcal/mol)
+  @param temperature (float): temperature (kelvin)
+  @return (np.ndarray): the affinity constants, in the same shape
+  """
+
+  return np.exp(-np.asarray(delta_G, dtype=float) / (R * temperature))
+
+
+def pad(energies:"list[list[float] | None]") -> np.ndarray:
+  """
+  stacks the pose energies of several dockings into one array
+  @param energies (list[list[float] | None]): the pose energies of each docking, None if not docked
+  @return (np.ndarray): a (dockings, poses) float array, padded with NaN
+  """
+
+  poses = max([len(row) for row in energies if row is not None] or [0])
+  matrix = np.full((len(energies), poses), np.nan)
+  for i, row in enumerate(energies):
+    if row is not None:
+      matrix[i, :len(row)] = row
+  return matrix
+
+
+def statistics(energies:np.ndarray, temperature:float=298.0) -> "dict[str, np.ndarray]":
+  """
+  summarizes the pose energies of every docking of a run at once, NaN poses being ignored
+  @param energies (np.ndarray): a (dockings, poses) array, see pad
+  @param temperature (float): temperature (kelvin)
+  @return (dict[str, np.ndarray]): per docking, the mean, Boltzmann-weighted, minimum and
+  median deltaG, the standard deviation of the poses (spread), their number, the Kd of the
+  Boltzmann-weighted deltaG and the mean Kd of the poses, NaN if not docked
+  """
+
+  energies = np.atleast_2d(np.asarray(energies, dtype=float))
+  valid = ~np.isnan(energies)
+  docked = valid.any(axis=1)
+  safe = np.where(valid, energies, np.inf)
+
+  # poses weighted by exp(-E / RT), shifted by the best pose to avoid overflows
+  RT = R * temperature
+  best = np.where(docked, safe.min(axis=1, initial=np.inf), 0.0)
+  weights = np.exp(-(safe - best[:, None]) / RT)
+  weights /= np.where(docked, weights.sum(axis=1), 1.0)[:, None]
+  boltzmann = np.where(docked, np.nansum(np.where(valid, weights * energies, 0.0), axis=1), np.nan)
+
+  # rows without poses give NaN
+  with warnings.catch_warnings():
+    warnings.simplefilter("ignore", RuntimeWarning)
+    return {
+      "mean": np.nanmean(energies, axis=1),
+      "boltzmann": boltzmann,
+      "min": np.where(docked, best, np.nan),
+      "median": np.nanmedian(energies, axis=1),
+      "spread": np.nanstd(energies, axis=1),
+      "poses": valid.sum(axis=1),
+      "boltzmann_Kd": kd(boltzmann, temperature),
+      "mean_Kd": np.nanmean(kd(energies, temperature), axis=1)
+    }
+
+
+def score(energies:np.ndarray, statistic:str="mean", temperature:float=298.0) -> "tuple[np.ndarray, np.ndarray]":
+  """
+  scores every docking of a run with one statistic of its pose energies
+  @param energies (np.ndarray): a (dockings, poses) array, see pad
+  @param statistic (str): "mean" (mean deltaG and mean Kd of the poses, the historical score),
+  "boltzmann", "min" or "median" (Kd of that deltaG)
+  @param temperature (float): temperature (kelvin)
+  @return (tuple[np.ndarray, np.ndarray]): the deltaG and Kd of each docking, NaN if not docked
+  """
+
+  if statistic not in STATISTICS:
+    raise ValueError(f"unknown statistic {statistic}, expected one of {', '.join(STATISTICS)}")
+
+  stats = statistics(energies, temperature)
+  if statistic == "mean":
+    return stats["mean"], stats["mean_Kd"]
+  return stats[statistic], kd(stats[statistic], temperature)
+
+
+def save_energies(path:str, names:"list[str]", energies:"list[list[float] | None]") -> None:
+  """
+  writes the pose energies of a run to a compressed NumPy file, so that it can be
+  ranked again with another statistic without docking it again
+  @param path (str): path to the output file (.npz)
+  @param names (list[str]): the ID of each docking
+  @param energies (list[list[float] | None]): the pose energies of each docking, None if not docked
+  """
+
+  # write then rename, so that no one reads half a file, in double precision, 
+  # so that ranking a run again with its statistic gives its summary back
+  with open(path + ".tmp", "wb") as file:
+    np.savez_compressed(file, names=np.array(names, dtype=str), energies=pad(energies))
+  os.replace(path + ".tmp", path)
+
+
+def load_energies(path:str) -> "tuple[list[str], np.ndarray]":
+  """
+  reads the pose energies of a run, see save_energies
+  @param path (str): path to the energies file (.npz)
+  @return (tuple[list[str], np.ndarray]): the ID of each docking and their (dockings, poses) energies
+  """
+
+  with np.load(path) as data:
+    return [str(name) for name in data["names"]], data["energies"].astype(float)
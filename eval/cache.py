@@ -0,0 +1,149 @@
+import os
+import json
+import hashlib
+
+class DockingCache:
+  def __init__(self, directory:str, max_entries:int=10000):
+    """
+    On-disk cache of docking energies, addressed by the content of the
+    docked files and the docking parameters. Entries are evicted in least
+    recently used order once the cache holds more than max_entries results.
+    @param directory (str): the folder where entries are stored.
+    @param max_entries (int): the maximum number of stored results.
+    """
+
+    self.directory = directory
+    self.max_entries = max_entries
+    os.makedirs(self.directory, exist_ok=True)
+
+
+  @staticmethod
+  def key(
+    receptor_file:str,
+    ligand_file:str,
+    center:"tuple[float, float, float]",
+    box_size:"tuple[float, float, float]",
+    n_dockings:int,
+    n_poses:int,
+    seed:int,
+    mode:str="dock") -> str:
+
+    """
+    Builds the address of a docking result.
+    @param receptor_file (str): path to the prepared receptor (pdbqt file).
+    @param ligand_file (str): path to the prepared ligand (pdbqt file).
+    @param center (tuple[float, float, float]): docking window center.
+    @param box_size (tuple[float, float, float]): docking window size.
+    @param n_dockings (int): number of docking simulations.
+    @param n_poses (int): number of poses kept.
+    @param seed (int): the vina seed.
+    @param mode (str): the docking mode, see eval.docking.docking.
+    @return (str): a sha256 hex digest.
+    """
+
+    contents = []
+    for path in (receptor_file, ligand_file):
+      with open(path, "rb") as file:
+        contents.append(file.read())
+    return DockingCache.content_key(*contents, center, box_size, n_dockings, n_poses, seed, mode)
+
+
+  @staticmethod
+  def content_key(
+    receptor:"bytes | str",
+    ligand:"bytes | str",
+    center:"tuple[float, float, float]",
+    box_size:"tuple[float, float, float]",
+    n_dockings:int,
+    n_poses:int,
+    seed:int,
+    mode:str="dock") -> str:
+
+    """
+    Builds the address of a docking result from the prepared contents, the
+    same as key() for files holding them.
+    @param receptor (bytes | str): the prepared receptor (pdbqt content).
+    @param ligand (bytes | str): the prepared ligand (pdbqt content).
+    @return (str): a sha256 hex digest.
+    """
+
+    digest = hashlib.sha256()
+    for content in (receptor, ligand):
+      digest.update(hashlib.sha256(content.encode() if isinstance(content, str) else content).digest())
+
+    # rounding avoids misses caused by float noise in the box computation
+    params = [round(float(x), 3) for x in (*center, *box_size)] + [n_dockings, n_poses, seed]
+    if mode != "dock": # keeps the keys of full dockings unchanged
+      params.append(mode)
+    digest.update(json.dumps(params).encode())
+    return digest.hexdigest()
+
+
+  def get(self, key:str) -> "list[float] | None":
+    """
+    Returns the energies stored under a key and marks them as recently used.
+    @param key (str): the entry address.
+    @return (list[float] | None): the stored energies, None on a miss.
+    """
+
+    path = self._path(key)
+    try:
+      with open(path, "r") as file:
+        energies = json.load(file)
+      os.utime(path) # the modification time is the LRU clock
+    except (FileNotFoundError, json.JSONDecodeError):
+      return None
+    return energies
+
+
+  def put(self, key:str, energies:"list[float]") -> None:
+    """
+    Stores energies under a key, then evicts the oldest entries if needed.
+    @param key (str): the entry address.
+    @param energies (list[float]): the energies of the docked poses.
+    """
+
+    # write then rename, so that concurrent readers never see half an entry
+    path = self._path(key)
+    with open(path + f".{os.getpid()}.tmp", "w") as file:
+      json.dump([float(e) for e in energies], file)
+    os.replace(path + f".{os.getpid()}.tmp", path)
+
+    self._evict()
+
+
+  def _evict(self) -> None:
+    """
+    Removes the least recently used entries beyond max_entries.
+    """
+
+    evict(self.directory, self.max_entries, ".json")
+
+
+  def _path(self, key:str) -> str:
+    return os.path.join(self.directory, f"{key}.json")
+
+
+def evict(directory:str, max_entries:int, suffix:str) -> None:
+  """
+  Removes the least recently used files of a cache folder beyond max_entries, 
+  their modification time being the LRU clock.
+  @param directory (str): the cache folder.
+  @param max_entries (int): the number of entries kept.
+  @param suffix (str): the extension of the entry files.
+  """
+
+  entries = []
+  for entry in os.scandir(directory):
+    if entry.name.endswith(suffix):
+      try:
+        entries.append((entry.stat().st_mtime, entry.path))
+      except FileNotFoundError: # removed by another worker
+        continue
+
+  entries.sort()
+  for _, path in entries[:max(0, len(entries) - max_entries)]:
+    try:
+      os.remove(path)
+    except FileNotFoundError:
+      continue
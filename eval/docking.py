@@ -11,44 +11,76 @@ def docking(
   n_poses:int=32,
   score=False,
   write=False,
-  verbosity=1) -> "list[float] | float":
+  cpu=0,
+  seed=0,
+  mode="dock",
+  verbosity=1,
+  timings=None,
+  ligand_string=None) -> "list[float] | float":
 
   """
   Docking simulation function : returns ...
   @param receptor_file: protein (pdbqt file)
-  @param ligand_file: ligand (pdbqt file)
+  @param ligand_file: ligand (pdbqt file), unused if ligand_string is given
   @param center: docking window center
   @param box_size: docking window size
   @param n_dockings: number of docking simulations
   @param n_poses: number of pose attempts per simulation
   @param score (bool): wether or not the output should be a single score
   @param write (bool): wether or not the poses should be saved to a file
+  @param cpu (int): number of CPUs used by vina (0 uses all of them)
+  @param seed (int): the vina random seed (0 picks a random one)
+  @param mode (str): "dock" for a full docking, "optimize" for the cheap 
+  score of the input pose after local minimization
   @param verbosity (int): the quantity of vina command line outputs
+  @param timings (dict | None): filled with the seconds spent computing the 
+  maps ("vina_maps") and docking ("vina_dock"), if given
+  @param ligand_string (str | None): the ligand pdbqt content, read from memory 
+  instead of ligand_file
   @return (list[float] | float): a list of scores or a single score
   """
 
   receptor_name = os.path.splitext(receptor_file)[-1].split('.')[0]
-  ligand_name = os.path.splitext(ligand_file)[-1].split('.')[0]
+  ligand_name = os.path.splitext(ligand_file)[-1].split('.')[0] if ligand_file else "ligand"
 
   # initialises vina
-  v = Vina(sf_name='vina', verbosity=verbosity)
+  v = Vina(sf_name='vina', cpu=cpu, seed=seed, verbosity=verbosity)
   v.set_receptor(receptor_file)
-  v.set_ligand_from_file(ligand_file)
+  if ligand_string is not None:
+    v.set_ligand_from_string(ligand_string)
+  else:
+    v.set_ligand_from_file(ligand_file)
 
   # set the docking frame
+  start = time.perf_counter()
   v.compute_vina_maps(center=center,box_size=box_size)
+  if timings is not None:
+    timings["vina_maps"] = time.perf_counter() - start
+  start = time.perf_counter()
+
+  # the input pose is only minimized for a cheap score, a full docking starts 
+  # from the same pose whatever the verbosity, so that seeded runs agree
+  if mode == "optimize":
+
+    # scores the current pose
+    energy = v.score()
+    if verbosity == 2:
+      print('Score before minimization: %.3f (kcal/mol)' % energy[0])
 
-  # scores the current pose
-  energy = v.score()
-  print('Score before minimization: %.3f (kcal/mol)' % energy[0])
+    # minimizes locally the current pose
+    energy_minimized = v.optimize()
+    if verbosity == 2:
+      print('Score after minimization : %.3f (kcal/mol)' % energy_minimized[0])
+    # v.write_pose(f'{ligand_name}_minimized.pdbqt', overwrite=True)
 
-  # minimizes locally the current pose
-  energy_minimized = v.optimize()
-  print('Score after minimization : %.3f (kcal/mol)' % energy_minimized[0])
-  # v.write_pose(f'{ligand_name}_minimized.pdbqt', overwrite=True)
+    if timings is not None:
+      timings["vina_dock"] = time.perf_counter() - start
+    return energy_minimized[0] if score else [energy_minimized[0]]
 
   # docks the ligand
   v.dock(exhaustiveness=n_dockings, n_poses=20)
+  if timings is not None:
+    timings["vina_dock"] = time.perf_counter() - start
 
   if write:
     v.write_poses(
@@ -1,20 +1,80 @@
-from Bio import PDB
+AMINO_ACIDS = {
+  "ALA": "A", "ARG": "R", "ASN": "N", "ASP": "D", "CYS": "C",
+  "GLN": "Q", "GLU": "E", "GLY": "G", "HIS": "H", "ILE": "I",
+  "LEU": "L", "LYS": "K", "MET": "M", "PHE": "F", "PRO": "P",
+  "SER": "S", "THR": "T", "TRP": "W", "TYR": "Y", "VAL": "V"
+}
 
-def get_sequence(structure):
+# force field names of protonation states, other residues with a C-alpha 
+# (MSE, SEP, ...) are read as X, so that changes at their positions are reported
+NONSTANDARD = {
+  "HSD": "H", "HSE": "H", "HSP": "H", "HID": "H", "HIE": "H", "HIP": "H",
+  "CYX": "C", "CYM": "C", "ASH": "D", "GLH": "E", "LYN": "K"
+}
+
+def get_sequence(protein_path:str) -> "dict[tuple[str, int, str], str]":
+  """
+  Reads the amino acids of the first model of a PDB file, without building a structure.
+  @param protein_path (str): the protein path.
+  @return (dict[tuple[str, int, str], str]): one-letter residue names, keyed by
+  (chain, residue number, insertion code) in file order.
+  """
+  with open(protein_path, "r") as file:
+    return parse_sequence(file)
+
+
+def parse_sequence(pdb_lines) -> "dict[tuple[str, int, str], str]":
   """
-  Loads a protein structure and returns the sequence of amino acids.
-  @param structure (str): the protein structure.
-  @return (sequence): the aa sequence of the protein.
+  Reads the amino acids of the first model of PDB lines, see get_sequence.
+  Non-standard residues, in ATOM or HETATM records, are kept when they have
+  a C-alpha atom, see NONSTANDARD.
+  @param pdb_lines: an iterable of PDB lines, such as an open file or block.splitlines().
+  @return (dict[tuple[str, int, str], str]): one-letter residue names, keyed by
+  (chain, residue number, insertion code) in file order.
   """
-  sequence = []
-  for model in structure:
-    for chain in model:
-      for residue in chain:
-        if PDB.is_aa(residue):
-          sequence.append(residue.resname)
+  sequence = {}
+  for line in pdb_lines:
+    if line.startswith("ENDMDL"):
+      break
+    if not line.startswith(("ATOM", "HETATM")):
+      continue
+
+    # the C-alpha (" CA ", not calcium "CA  ") tells residues from ligands and ions
+    name = line[17:20]
+    if name in AMINO_ACIDS and line.startswith("ATOM"):
+      letter = AMINO_ACIDS[name]
+    elif line[12:16] == " CA ":
+      letter = NONSTANDARD.get(name, AMINO_ACIDS.get(name, "X"))
+    else:
+      continue
+    key = (line[21], int(line[22:26]), line[26].strip())
+    sequence.setdefault(key, letter)
   return sequence
 
 
+def diff(sequence1:dict, sequence2:dict) -> "list[str]":
+  """
+  Lists the mutations between two sequences returned by get_sequence, aligned
+  by chain and residue number. If the second protein was renumbered (no
+  residue in common), residues are aligned by position instead.
+  @param sequence1 (dict): the original sequence.
+  @param sequence2 (dict): the mutated sequence.
+  @return (list[str]): mutations such as A123K, prefixed with the chain (B:A123K)
+  when the protein has several chains.
+  """
+  if sequence1.keys().isdisjoint(sequence2.keys()):
+    pairs = zip(sequence1.items(), sequence2.values())
+  else:
+    pairs = ((item, sequence2[item[0]]) for item in sequence1.items() if item[0] in sequence2)
+
+  chains = len({chain for chain, _, _ in sequence1}) > 1
+  mutations = []
+  for ((chain, number, icode), res1), res2 in pairs:
+    if res1 != res2:
+      mutations.append(f"{chain}:" * chains + f"{res1}{number}{icode}{res2}")
+  return mutations
+
+
 def mutations(protein1_path, protein2_path):
   """
   Loads two protein paths and returns the number of mutations between them.
@@ -22,13 +82,15 @@ def mutations(protein1_path, protein2_path):
   @param protein2_path (str): the second protein path.
   @return (int): the number of mutations between the two proteins.
   """
-  parser = PDB.PDBParser()
-  structure1 = parser.get_structure('protein1', protein1_path)
-  structure2 = parser.get_structure('protein2', protein2_path)
-  seq1 = get_sequence(structure1)
-  seq2 = get_sequence(structure2)
-  mutations = []
-  for i, (res1, res2) in enumerate(zip(seq1, seq2)):
-    if res1 != res2:
-      mutations.append((i + 1, res1, res2))
-  return len(mutations)
+  return len(diff(get_sequence(protein1_path), get_sequence(protein2_path)))
+
+
+def mutations_batch(original_path:str, mutant_paths:"list[str]") -> "list[list[str]]":
+  """
+  Lists the mutations of every mutant of a run, parsing the original protein once.
+  @param original_path (str): the original protein path.
+  @param mutant_paths (list[str]): the mutated protein paths.
+  @return (list[list[str]]): the mutations of each mutant (see diff), in order.
+  """
+  original = get_sequence(original_path)
+  return [diff(original, get_sequence(path)) for path in mutant_paths]
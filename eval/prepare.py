@@ -1,21 +1,108 @@
 import os
 import subprocess
 
-def prepare(file_path:str) -> str:
+try:
+    from openbabel import pybel
+except ImportError: # falls back to the obabel command line
+    pybel = None
+
+def prepare(file_path:str, backend:str="auto") -> str:
     """
-    Convert a PDB file to PDBQT format using Open Babel.
-    @param file_path: path to the input PDB file
+    Convert a PDB or SDF file to PDBQT format using Open Babel, unless
+    the PDBQT file is already more recent than the input file.
+    @param file_path: path to the input PDB or SDF file
+    @param backend: "pybel" converts in-process, "obabel" spawns the command
+    line tool, "auto" uses pybel when the bindings are installed
     @return: path to the output PDBQT file
     """
 
     # defines the output file name
     pdbqt_file = os.path.splitext(file_path)[0] + '.pdbqt'
     pdbqt_file = pdbqt_file.replace('raw', 'preped')
-    
-    # converts PDB to PDBQT using Open Babel
-    flags = "-xc -xr" if file_path.endswith("pdb") else ""
-    command = f'obabel {file_path} -opdbqt -O {pdbqt_file} -h {flags}'
-    command += "--partialcharge gasteiger" # includes forces and charges
-    subprocess.run(command, shell=True)
+
+    if _is_up_to_date(pdbqt_file, file_path):
+        return pdbqt_file
+
+    if backend == "auto":
+        backend = "obabel" if pybel is None else "pybel"
+
+    is_receptor = file_path.endswith("pdb")
+
+    if backend == "pybel":
+        file_format = os.path.splitext(file_path)[1][1:]
+        molecule = next(pybel.readfile(file_format, file_path))
+        molecule.addh()
+        molecule.calccharges("gasteiger") # includes forces and charges
+
+        # -xc -xr : rigid receptor without torsion tree
+        options = {"c": None, "r": None} if is_receptor else {}
+        molecule.write("pdbqt", pdbqt_file, overwrite=True, opt=options)
+    else:
+        # converts PDB to PDBQT using Open Babel
+        flags = ["-xc", "-xr"] if is_receptor else []
+        command = ["obabel", file_path, "-opdbqt", "-O", pdbqt_file, "-h", *flags]
+        command += ["--partialcharge", "gasteiger"] # includes forces and charges
+        subprocess.run(command, check=True, capture_output=True)
 
     return pdbqt_file
+
+
+def prepare_all(file_paths:"list[str]", backend:str="auto") -> "list[str]":
+    """
+    Convert a batch of receptors and ligands (e.g. every docking input of a run)
+    to PDBQT format, skipping the files whose PDBQT is already up to date.
+    @param file_paths: paths to the input PDB or SDF files
+    @param backend: the conversion backend, see prepare()
+    @return: paths to the PDBQT files, in the same order
+    """
+
+    pdbqt_files = []
+    for file_path in file_paths:
+        try:
+            pdbqt_files.append(prepare(file_path, backend))
+        except Exception as e: # reported again when this file is docked
+            print(f"\t\terror preparing {file_path}: {e}")
+            pdbqt_files.append(None)
+
+    return pdbqt_files
+
+
+def prepare_string(block:str, file_format:str, backend:str="auto") -> str:
+    """
+    Convert the content of a PDB or SDF file to PDBQT format in memory,
+    without writing any file
+    @param block: the content of the input file
+    @param file_format: "pdb" for a receptor, "sdf" for a ligand
+    @param backend: the conversion backend, see prepare()
+    @return: the content of the PDBQT file
+    """
+
+    if backend == "auto":
+        backend = "obabel" if pybel is None else "pybel"
+
+    is_receptor = file_format == "pdb"
+
+    if backend == "pybel":
+        molecule = pybel.readstring(file_format, block)
+        molecule.addh()
+        molecule.calccharges("gasteiger") # includes forces and charges
+
+        # -xc -xr : rigid receptor without torsion tree
+        options = {"c": None, "r": None} if is_receptor else {}
+        return molecule.write("pdbqt", opt=options)
+
+    # obabel reads stdin and writes stdout when no file is given
+    flags = ["-xc", "-xr"] if is_receptor else []
+    command = ["obabel", f"-i{file_format}", "-opdbqt", "-h", *flags, "--partialcharge", "gasteiger"]
+    return subprocess.run(command, input=block, check=True, capture_output=True, text=True).stdout
+
+
+def _is_up_to_date(pdbqt_file:str, file_path:str) -> bool:
+    """
+    Tells whether a PDBQT file was written after its source file.
+    @param pdbqt_file: path to the output PDBQT file
+    @param file_path: path to the input file
+    @return: True if the conversion can be skipped
+    """
+
+    return os.path.isfile(pdbqt_file) and os.path.getmtime(pdbqt_file) >= os.path.getmtime(file_path)
@@ -1,51 +1,216 @@
+import os
 from rdkit import Chem
-from Bio.PDB import PDBParser
 import numpy as np
 
-def compute_box(
-    receptor_path:str, 
-    ligand_path:str, 
-    cutoff:float=5.0, 
-    padding:float=5.0) -> "dict[str, tuple[float, float, float]]":
-    
+def load_coordinates(receptor_path:str) -> np.ndarray:
     """
-    calculates the dimensions and center of the docking box
+    reads the atom coordinates of a PDB file into an array, without building a structure
     @param receptor_path: path to the receptor file (.pdb)
+    @return: an (n_atoms, 3) float array
+    """
+
+    with open(receptor_path, "r") as file:
+        return parse_coordinates(file)
+
+
+def parse_coordinates(pdb_lines) -> np.ndarray:
+    """
+    reads the atom coordinates of PDB lines into an array, see load_coordinates
+    @param pdb_lines: an iterable of PDB lines, such as an open file or block.splitlines()
+    @return: an (n_atoms, 3) float array
+    """
+
+    # keeps the first alternate location only, as Bio.PDB does for most files
+    lines = [line for line in pdb_lines
+        if line.startswith(("ATOM", "HETATM")) and len(line) >= 54 and line[16] in " A1"]
+
+    if not lines:
+        return np.zeros((0, 3))
+
+    # x, y and z are fixed width columns 31-54
+    return np.array([(line[30:38], line[38:46], line[46:54]) for line in lines], dtype=float)
+
+
+def load_ligand(ligand_path:str) -> np.ndarray:
+    """
+    reads the atom coordinates of the first molecule of a SDF file
     @param ligand_path: path to the ligand file (.sdf)
+    @return: an (n_atoms, 3) float array
+    """
+
+    ligand = Chem.SDMolSupplier(ligand_path)[0]
+    if ligand is None:
+        raise ValueError(f"cannot read a molecule from {ligand_path}")
+    return np.asarray(ligand.GetConformer().GetPositions(), dtype=float)
+
+
+def parse_ligand(sdf_block:str) -> np.ndarray:
+    """
+    reads the atom coordinates of the first molecule of a SDF block, see load_ligand
+    @param sdf_block: the content of a SDF file
+    @return: an (n_atoms, 3) float array
+    """
+
+    ligand = Chem.MolFromMolBlock(sdf_block)
+    if ligand is None:
+        # the first line of a SDF block is the molecule name
+        title = sdf_block.strip().split("\n", 1)[0]
+        raise ValueError(f"cannot read a molecule from the SDF block starting with '{title[:80]}'")
+    return np.asarray(ligand.GetConformer().GetPositions(), dtype=float)
+
+
+def box_around(
+    receptor_coords:np.ndarray,
+    ligand_coords:np.ndarray,
+    cutoff:float=5.0,
+    padding:float=5.0) -> "dict[str, tuple[float, float, float]]":
+
+    """
+    calculates the docking box from coordinates arrays
+    @param receptor_coords: (n_atoms, 3) receptor coordinates
+    @param ligand_coords: (n_atoms, 3) ligand coordinates
     @param cutoff: capture distance for neighbour atoms (angstrom)
     @param padding: padding around the box to ensure the ligand is inside (angstrom)
     @return: center coordinates (x, y, z) and sizes (x, y, z) of the box
     """
-    
-    ligand = Chem.SDMolSupplier(ligand_path)[0]
-    ligand_coords = np.array([list(ligand.GetConformer().GetAtomPosition(i)) 
-        for i in range(ligand.GetNumAtoms())])
-    structure = PDBParser(QUIET=True).get_structure('receptor', receptor_path)
-    atoms = list(structure.get_atoms()) # get all atoms in receptor
 
     # compute the geometric center of the ligand (center of mass)
-    ligand_center = np.mean(ligand_coords, axis=0).astype(float)
-    
-    # collect atoms close to the ligand
-    site_atoms = np.array([atom.coord 
-        for atom in atoms 
-        if np.linalg.norm(atom.coord - ligand_center) <= cutoff]).astype(float)
+    ligand_center = np.mean(ligand_coords, axis=0)
+
+    # collect atoms close to the ligand, squared distances avoid a square root per atom
+    squared = np.einsum("ij,ij->i", receptor_coords - ligand_center, receptor_coords - ligand_center)
+    site_atoms = receptor_coords[squared <= cutoff ** 2]
     if site_atoms.size == 0:
         site_atoms = ligand_coords
 
     # compute min/max coordinates for the docking box
     x_min, y_min, z_min = np.min(site_atoms, axis=0)
     x_max, y_max, z_max = np.max(site_atoms, axis=0)
-    
+
     return {
         "center": (
-            (x_min + x_max) / 2, 
-            (y_min + y_max) / 2, 
-            (z_min + z_max) / 2
+            float(x_min + x_max) / 2,
+            float(y_min + y_max) / 2,
+            float(z_min + z_max) / 2
         ),
         "size": (
-            (x_max - x_min) + 2 * padding, 
-            (y_max - y_min) + 2 * padding, 
-            (z_max - z_min) + 2 * padding
+            float(x_max - x_min) + 2 * padding,
+            float(y_max - y_min) + 2 * padding,
+            float(z_max - z_min) + 2 * padding
         )
-    }
\ No newline at end of file
+    }
+
+
+def compute_box(
+    receptor_path:str,
+    ligand_path:str,
+    cutoff:float=5.0,
+    padding:float=5.0) -> "dict[str, tuple[float, float, float]]":
+
+    """
+    calculates the dimensions and center of the docking box
+    @param receptor_path: path to the receptor file (.pdb)
+    @param ligand_path: path to the ligand file (.sdf)
+    @param cutoff: capture distance for neighbour atoms (angstrom)
+    @param padding: padding around the box to ensure the ligand is inside (angstrom)
+    @return: center coordinates (x, y, z) and sizes (x, y, z) of the box
+    """
+
+    return box_around(load_coordinates(receptor_path), load_ligand(ligand_path), cutoff, padding)
+
+
+def compute_boxes(
+    receptor_paths:"list[str]",
+    ligand_paths:"str | list[str]",
+    cutoff:float=5.0,
+    padding:float=5.0) -> "list[dict[str, tuple[float, float, float]]]":
+
+    """
+    calculates the docking boxes of a whole run at once, each ligand file being read only once
+    @param receptor_paths: paths to the receptor files (.pdb)
+    @param ligand_paths: a single ligand file shared by all receptors, or one per receptor (.sdf)
+    @param cutoff: capture distance for neighbour atoms (angstrom)
+    @param padding: padding around the box to ensure the ligand is inside (angstrom)
+    @return: a box (see compute_box) per receptor, in the same order
+    """
+
+    if isinstance(ligand_paths, str):
+        ligand_paths = [ligand_paths] * len(receptor_paths)
+
+    ligands = {path: load_ligand(path) for path in set(ligand_paths)}
+    return [box_around(load_coordinates(receptor_path), ligands[ligand_path], cutoff, padding)
+        for receptor_path, ligand_path in zip(receptor_paths, ligand_paths)]
+
+
+def compute_box_from_blocks(
+    pdb_block:str,
+    sdf_block:str,
+    cutoff:float=5.0,
+    padding:float=5.0) -> "dict[str, tuple[float, float, float]]":
+
+    """
+    calculates the docking box from the contents of the receptor and ligand files, without reading them
+    @param pdb_block: the content of the receptor file (.pdb)
+    @param sdf_block: the content of the ligand file (.sdf)
+    @param cutoff: capture distance for neighbour atoms (angstrom)
+    @param padding: padding around the box to ensure the ligand is inside (angstrom)
+    @return: center coordinates (x, y, z) and sizes (x, y, z) of the box
+    """
+
+    return box_around(parse_coordinates(pdb_block.splitlines()), parse_ligand(sdf_block), cutoff, padding)
+
+
+def truncate_to_box(
+    pdb_lines,
+    box:"dict[str, tuple[float, float, float]]",
+    radius:float=8.0) -> "list[str]":
+
+    """
+    keeps the residues having at least one atom within radius of the docking box, 
+    as atoms further away do not contribute to the vina grid maps
+    @param pdb_lines: an iterable of PDB lines, such as an open file or block.splitlines()
+    @param box: the docking box, see compute_box
+    @param radius: distance to the box under which residues are kept (angstrom)
+    @return: the PDB lines of the truncated receptor, newline-terminated
+    """
+
+    lines = [line.rstrip("\n") for line in pdb_lines if line.startswith(("ATOM", "HETATM")) and len(line) >= 54]
+    if not lines:
+        return ["END\n"]
+
+    # distance of each atom to the box faces, 0 inside the box
+    coords = np.array([(line[30:38], line[38:46], line[46:54]) for line in lines], dtype=float)
+    outside = np.maximum(np.abs(coords - np.asarray(box["center"])) - np.asarray(box["size"]) / 2, 0)
+    close = np.einsum("ij,ij->i", outside, outside) <= radius ** 2
+
+    # whole residues are kept, keyed by chain, number and insertion code
+    residues = {line[21:27] for line, keep in zip(lines, close) if keep}
+    return [line + "\n" for line in lines if line[21:27] in residues] + ["END\n"]
+
+
+def write_pocket(
+    receptor_path:str,
+    box:"dict[str, tuple[float, float, float]]",
+    radius:float=8.0) -> str:
+
+    """
+    writes the receptor truncated around the docking box next to it (see truncate_to_box), 
+    unless it is already more recent than the receptor
+    @param receptor_path: path to the receptor file (.pdb)
+    @param box: the docking box, see compute_box
+    @param radius: distance to the box under which residues are kept (angstrom)
+    @return: path to the truncated receptor file (.pdb)
+    """
+
+    pocket_path = os.path.splitext(receptor_path)[0] + f"_pocket{radius:g}.pdb"
+    if os.path.isfile(pocket_path) and os.path.getmtime(pocket_path) >= os.path.getmtime(receptor_path):
+        return pocket_path
+
+    with open(receptor_path, "r") as file:
+        lines = truncate_to_box(file, box, radius)
+
+    # write then rename, so that concurrent workers never read half a file
+    with open(pocket_path + f".{os.getpid()}.tmp", "w") as file:
+        file.writelines(lines)
+    os.replace(pocket_path + f".{os.getpid()}.tmp", pocket_path)
+    return pocket_path
@@ -1,40 +1,246 @@
-from model.Model import Model
+from model.server import Server
+from model.manifest import read_manifest, write_summary
+from model.catalog import Catalog
+from model.tracing import Tracer, export_chrome
+from model.workqueue import WorkQueue, work
+from eval.cache import DockingCache
+import os
 import argparse
-import torch
 
-# if called from command line
+def batch_size(value:str) -> "int | str":
+  """
+  Parses --batch-size, the number of mutants per inference pass.
+  @param value (str): "auto" or a positive integer.
+  @return (int | str): the batch size, or "auto".
+  """
+
+  if value == "auto":
+    return value
+  if not value.isdigit() or int(value) < 1:
+    raise argparse.ArgumentTypeError(f"expected auto or a positive integer, got {value}")
+  return int(value)
+
+# if called from command line, the model stack is only imported here : spawned 
+# docking workers run this module again, as __mp_main__
 if __name__ == "__main__":
+  import torch
+  from model.Model import Model, SETUP_STAGES
+
   torch.set_warn_always(False)
   parser = argparse.ArgumentParser()
 
-  parser.add_argument("-d", "--device", type=str, default="cuda:0", help="Set the device (cpu or cuda:0)")
+  parser.add_argument("-d", "--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu", help="Set the device (cpu or cuda:0)")
   parser.add_argument("-o", "--output", type=str, default="./results", help="Set the path for the output directory")
   parser.add_argument("-v", "--verbose", type=int, choices=[0, 1, 2], default=1, help="Set the verbosity between 0 and 2")
-  parser.add_argument("--receptor", type=str, required=True, help="Set the receptor filepath")
-  parser.add_argument("--ligand", type=str, required=True, help="Set the ligand filepath")
+  parser.add_argument("--receptor", type=str, help="Set the receptor filepath")
+  parser.add_argument("--ligand", type=str, help="Set the ligand filepath")
   parser.add_argument("-n", "--number", type=int, default=8, help="Chose the number of generated mutants")
+  parser.add_argument("-b", "--batch-size", type=batch_size, default=1, help="Set the number of mutants per inference pass (or auto)")
+  parser.add_argument("--seed", type=int, default=2089, help="Set the base seed of the generation")
+  parser.add_argument("--dedup", type=str, choices=["off", "skip", "link"], default="link", help="Skip identical mutants, or link them to the first one instead of docking them")
+  parser.add_argument("--unique", action='store_true', help="Keep sampling until the number of unique mutants is reached")
+  parser.add_argument("--max-attempts", type=int, default=0, help="Set the maximum number of samples per target in unique mode (defaults to 4 times the number)")
+  parser.add_argument("--precision", type=str, choices=["fp32", "bf16", "int8"], default="fp32", help="Set the precision of the linear layers (int8 is cpu only)")
+  parser.add_argument("--threads", type=int, default=0, help="Set the intra-op threads of the inference (0 keeps the torch default)")
+  parser.add_argument("--interop-threads", type=int, default=0, help="Set the inter-op threads of the inference (0 keeps the torch default)")
+  parser.add_argument("--compile", action='store_true', help="Compile the PocketGen networks with torch.compile")
+  parser.add_argument("--compare-precision", action='store_true', help="Compare the speed and outputs of the selected precision with fp32, then exit")
+  parser.add_argument("-w", "--workers", type=int, default=1, help="Set the number of parallel docking processes")
+  parser.add_argument("--vina-cpu", type=int, default=0, help="Set the CPUs per docking process (0 shares them evenly)")
+  parser.add_argument("--screen", type=str, choices=["optimize", "dock"], default=None, help="Rank mutants with a cheap docking pass before the full one")
+  parser.add_argument("--screen-top", type=int, default=0, help="Set the number of best triaged mutants that are fully docked")
+  parser.add_argument("--screen-threshold", type=float, default=None, help="Fully dock mutants triaged at most this far above the original (kcal/mol)")
+  parser.add_argument("--screen-exhaustiveness", type=int, default=8, help="Set the exhaustiveness of the triage docking (dock screen)")
+  parser.add_argument("--statistic", type=str, choices=["mean", "boltzmann", "min", "median"], default="mean", help="Set the statistic of the pose energies that scores the mutants")
+  parser.add_argument("--rerank", action='store_true', help="Score the finished runs of the output directory again with --statistic, without docking, then exit")
+  parser.add_argument("--pocket-radius", type=float, default=None, help="Set the distance to the docking box beyond which receptor residues are left out of docking (angstrom)")
+  parser.add_argument("--pocket-validate", action='store_true', help="Dock the whole receptors as well and report the deviation of the truncated scores")
+  parser.add_argument("--pipeline", action='store_true', help="Dock mutants while the next ones are generated")
+  parser.add_argument("--in-memory", action='store_true', help="Dock pipelined mutants from memory, without intermediate files on the output filesystem")
+  parser.add_argument("--scratch", type=str, default=None, help="Set the node-local directory of the in-memory path (defaults to the system temporary one)")
+  parser.add_argument("--queue", type=str, default=None, help="Set a shared directory where docking jobs are queued for --worker processes")
+  parser.add_argument("--worker", action='store_true', help="Dock the jobs of --queue, possibly from another node, instead of generating")
+  parser.add_argument("--lease", type=float, default=300, help="Set the seconds a queued job may run without heartbeat before it is requeued")
+  parser.add_argument("--lease-attempts", type=int, default=3, help="Set the number of leases of a queued job before it is failed")
+  parser.add_argument("--idle", type=float, default=0, help="Set the seconds a worker waits on an empty queue before exiting (0 waits forever)")
+  parser.add_argument("--queue-size", type=int, default=0, help="Set the number of mutants waiting for docking (defaults to twice the workers)")
+  parser.add_argument("--cache", type=str, default=None, help="Set the cache directory (defaults to <output>/.cache)")
+  parser.add_argument("--cache-size", type=int, default=10000, help="Set the maximum number of cached docking results, and of cached input features (0 disables caching)")
+  parser.add_argument("--profile-startup", action='store_true', help="Print the time and peak RSS of each setup phase")
+  parser.add_argument("--trace", type=str, default=None, help="Set a JSON-lines log of the time and memory of every stage")
+  parser.add_argument("--chrome-trace", type=str, default=None, help="Set a Chrome / Perfetto trace file written from the stages log")
+  parser.add_argument("--profile", type=str, default=None, help="Set a directory for the cProfile statistics of the hot stages")
+  parser.add_argument("--manifest", type=str, default=None, help="Set a CSV or JSONL file of receptor, ligand and number rows")
+  parser.add_argument("--pocket-tolerance", type=float, default=0.25, help="Set the relative pocket size difference allowed in a shared batch")
+  parser.add_argument("--serve", action='store_true', help="Keep the model warm and run jobs received over HTTP")
+  parser.add_argument("--host", type=str, default="127.0.0.1", help="Set the interface the server listens on")
+  parser.add_argument("--port", type=int, default=8089, help="Set the port the server listens on")
+  parser.add_argument("--socket", type=str, default=None, help="Set a Unix socket the server listens on instead of TCP")
+  parser.add_argument("--rounds", type=int, default=0, help="Set the number of design rounds of a campaign, each one starting from the best mutants of the previous one")
+  parser.add_argument("--campaign-top", type=int, default=1, help="Set the number of best mutants kept as parents after each campaign round")
+  parser.add_argument("--resume", action='store_true', help="Complete the interrupted runs of the output directory")
+  parser.add_argument("--top", type=int, default=None, help="Print the best mutants of all runs from the catalog, then exit")
+  parser.add_argument("--runs", action='store_true', help="Print the runs of the catalog, then exit")
   parser.add_argument("--generation", action='store_true', help="Set if the model will generate new mutants")
   parser.add_argument('--no-generation', dest='generation', action='store_false')
   parser.set_defaults(generation=True)
 
   # parse arguments
   args = parser.parse_args()
+
+  # catalog queries do not need the model
+  if args.top is not None or args.runs:
+    catalog = Catalog(args.output)
+    rows = catalog.top(args.top) if args.top is not None else catalog.summary()
+    if rows:
+      print("\t".join(rows[0]))
+    for row in rows:
+      print("\t".join("-" if value is None else str(value) for value in row.values()))
+    raise SystemExit(0)
+
+  # workers only dock, they do not need the model either
+  if args.worker:
+    if not args.queue:
+      parser.error("--worker needs the --queue directory of the generator")
+    Tracer(args.trace, args.profile).install()
+    cache = None
+    if args.cache_size > 0:
+      cache = DockingCache(os.path.join(args.cache or os.path.join(args.output, ".cache"), "docking"), args.cache_size)
+
+    if args.verbose > 0:
+      print(f"Docking the jobs queued in {args.queue} :")
+    docked = work(WorkQueue(args.queue, args.lease, args.lease_attempts), cpu=args.vina_cpu, cache=cache, idle=args.idle, verbose=args.verbose)
+
+    if args.verbose > 0:
+      print(f"Docked {docked} jobs.")
+    raise SystemExit(0)
+
+  if not (args.serve or args.manifest or args.resume or args.rerank) and not (args.receptor and args.ligand):
+    parser.error("--receptor and --ligand are required unless --serve, --manifest, --resume or --rerank is set")
+  if args.unique and args.dedup == "off":
+    parser.error("--unique counts the mutants found unique by --dedup, which cannot be off")
+  if args.precision == "int8" and args.device != "cpu":
+    parser.error("--precision int8 is only available on cpu")
+  if args.in_memory and not args.pipeline:
+    parser.error("--in-memory hands mutants straight to docking and needs --pipeline")
+  if args.pipeline and args.queue:
+    parser.error("--queue docks whole runs and cannot be pipelined")
+  if args.pocket_validate and (args.pocket_radius is None or args.pipeline):
+    parser.error("--pocket-validate needs --pocket-radius and cannot be pipelined")
+  if args.rounds and (args.pipeline or args.manifest):
+    parser.error("--rounds docks each round before the next one and cannot be pipelined or used with --manifest")
+  if args.pipeline and args.screen:
+    parser.error("--screen needs every mutant before docking and cannot be pipelined")
+  if args.screen and not (args.screen_top or args.screen_threshold is not None):
+    parser.error("--screen needs --screen-top and / or --screen-threshold, it would fully dock every mutant otherwise")
   
+  # the chrome trace is converted from the stages log, an implicit log only holds this invocation
+  if args.chrome_trace and not args.trace:
+    args.trace = os.path.join(args.output, "trace.jsonl")
+    if os.path.isfile(args.trace):
+      os.remove(args.trace)
+
   # instantiates the model with args
   flint = Model("./checkpoints/checkpoint.pt", {
     "device": args.device,
     "output": args.output,
     "verbose": args.verbose,
-    "number": args.number
+    "number": args.number,
+    "batch_size": args.batch_size,
+    "seed": args.seed,
+    "dedup": args.dedup,
+    "unique": args.unique,
+    "max_attempts": args.max_attempts,
+    "workers": args.workers,
+    "vina_cpu": args.vina_cpu,
+    "queue_size": args.queue_size,
+    "queue": args.queue,
+    "lease": args.lease,
+    "lease_attempts": args.lease_attempts,
+    "in_memory": args.in_memory,
+    "scratch": args.scratch,
+    "statistic": args.statistic,
+    "pocket_radius": args.pocket_radius,
+    "pocket_validate": args.pocket_validate,
+    "screen": args.screen,
+    "screen_top": args.screen_top,
+    "screen_threshold": args.screen_threshold,
+    "screen_exhaustiveness": args.screen_exhaustiveness,
+    "cache": args.cache,
+    "cache_size": args.cache_size,
+    "pocket_tolerance": args.pocket_tolerance,
+    "precision": args.precision,
+    "threads": args.threads,
+    "interop_threads": args.interop_threads,
+    "compile": args.compile,
+    "trace": args.trace,
+    "profile": args.profile
   })
 
-  if args.generation:
+  if args.serve:
+
+    # load the checkpoint now rather than during the first job
+    flint.model
+    server = Server(flint, host=args.host, port=args.port, socket_path=args.socket)
+
+    if args.verbose > 0:
+      print(f"Flint is waiting for jobs on {args.socket or f'{args.host}:{args.port}'}.")
+    server.serve_forever()
+
+  elif args.manifest:
+
+    # every target shares the loaded model and the inference batches
+    targets = read_manifest(args.manifest, number=args.number)
+    runs = flint.generate_many(targets)
+    flint.results(runs)
+
+    summary_path = os.path.join(args.output, os.path.splitext(os.path.basename(args.manifest))[0] + "_summary.tsv")
+    write_summary(summary_path, targets, runs)
+
+    if args.verbose > 0:
+      print(f"You can find the combined summary in {summary_path}.")
+
+  elif args.rerank:
+
+    # the pose energies of every run are kept, nothing is docked again
+    flint.rerank()
+
+  elif args.compare_precision:
+
+    # one batch with each model, nothing is docked
+    flint.input(args.receptor, args.ligand).compare_precision()
+
+  elif args.rounds:
+
+    # every round is generated, docked and scored before the next one
+    flint.campaign(args.receptor, args.ligand, args.rounds, args.campaign_top)
+
+  elif args.resume:
+
+    # generates the missing mutants, results() then docks the missing jobs
+    flint.resume()
+
+  elif args.generation:
 
     # pass molecule files to the model 
     flint.input(args.receptor, args.ligand)
 
-    # begin the inference / generate mutants
-    flint.generate()
+    # begin the inference / generate mutants, docked on the fly when pipelined
+    if args.pipeline:
+      flint.pipeline()
+    else:
+      flint.generate()
 
   # output the results and write the summary file
-  flint.results()
\ No newline at end of file
+  if not (args.serve or args.manifest or args.compare_precision or args.rounds or args.rerank):
+    flint.results()
+
+  # setup phases, including the ones deferred until the first generation
+  if args.profile_startup:
+    print(flint.tracer.report(SETUP_STAGES))
+
+  if args.chrome_trace:
+    export_chrome(args.trace, args.chrome_trace)
+
+    if args.verbose > 0:
+      print(f"You can open {args.chrome_trace} in Perfetto or chrome://tracing.")
\ No newline at end of file
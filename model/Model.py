@@ -1,29 +1,40 @@
 import esm
+import json
 import torch
+import numpy as np
 import os 
+import time
 import shutil
-from torch.utils.data import DataLoader
+import hashlib
+import tempfile
 from functools import partial
-import numpy as np
+from contextlib import ExitStack
 
 from PocketGen.models.PD import Pocket_Design_new
 from PocketGen.utils.misc import seed_all, load_config
 from PocketGen.utils.transforms import FeaturizeProteinAtom, FeaturizeLigandAtom
 from PocketGen.utils.data import collate_mols_block
 
-from .sampler import interaction
-from eval.docking import docking
-from eval.prepare import prepare
-from eval.window import compute_box
-from eval.mutations import mutations
-from eval.chemutils import kd
+from .sampler import interaction, interaction_frame, update_interaction
+from .scoring import dock_all, dock_queued, docking_pool, DockingPipeline
+from .tracing import Tracer
+from .journal import Journal
+from .catalog import Catalog
+from .workqueue import WorkQueue
+from eval.mutations import mutations_batch, get_sequence, parse_sequence, diff
+from eval.window import compute_box, compute_boxes, load_coordinates
+from eval.cache import DockingCache
+from eval.affinity import score as pose_score, pad, save_energies, load_energies
+
+# the spans of the model setup, some of them deferred until the first generation
+SETUP_STAGES = ("config", "torch", "alphabet", "checkpoint", "instantiation", "to_device", "load_state_dict", "optimization")
 
 class Model:
   def __init__(self, checkpoint_path:str, args):
     """
     The mutant generation model constructor. This method does the setup of 
-    torch and CUDA environment, loads the checkpoint and then returns a PocketGen 
-    instance using the weights from checkpoints and the parameters retrieved.
+    torch and CUDA environment and retrieves the ESM alphabet. The checkpoint 
+    and the PocketGen instance are only loaded the first time the model is used.
     @param checkpoint_path (str): Path to checkpoint (.pt) file for PocketGen.
     @param verbose (int): 0 for quiet, 1 for necessary information and 2 for debug.
     """
@@ -33,8 +44,50 @@ class Model:
     self.device = args["device"]
     self.outputdir = args["output"]
     self.size = args["number"]
+    self.batch_size = args.get("batch_size", 1)
+    self.seed = args.get("seed", 2089)
+    self.pocket_tolerance = args.get("pocket_tolerance", 0.25)
+    self.dedup = args.get("dedup", "link")
+    self.unique = args.get("unique", False)
+    self.max_attempts = args.get("max_attempts", 0)
+    self.workers = args.get("workers", 1)
+    self.pool = None # the docking processes of results(), see _docking_pool
+    self.vina_cpu = args.get("vina_cpu", 0)
+    self.queue_size = args.get("queue_size", 0) or 2 * self.workers
+    self.screen = args.get("screen")
+    self.screen_top = args.get("screen_top", 0)
+    self.screen_threshold = args.get("screen_threshold")
+    self.screen_exhaustiveness = args.get("screen_exhaustiveness", 8)
+    self.precision = args.get("precision", "fp32")
+    self.threads = args.get("threads", 0)
+    self.interop_threads = args.get("interop_threads", 0)
+    self.compile = args.get("compile", False)
+    self.in_memory = args.get("in_memory", False)
+    self.scratch = args.get("scratch") or tempfile.gettempdir()
+    self.pocket_radius = args.get("pocket_radius")
+    self.pocket_validate = args.get("pocket_validate", False)
+    self.box = None # docking window shared by every job, computed per job if None
+    self.statistic = args.get("statistic", "mean")
+    self.work_queue = None
+    if args.get("queue"):
+      self.work_queue = WorkQueue(args["queue"], args.get("lease", 300), args.get("lease_attempts", 3))
+    self.cachedir = args.get("cache") or os.path.join(self.outputdir, ".cache")
+    self.docking_cache = None
+    self.features_cache = None
+    if args.get("cache_size", 10000) > 0:
+      self.docking_cache = DockingCache(os.path.join(self.cachedir, "docking"), args.get("cache_size", 10000))
+      self.features_cache = os.path.join(self.cachedir, "features")
+    self.features_cache_size = args.get("cache_size", 10000)
     self.sources = []
-    self.config = load_config('./PocketGen/configs/train_model.yml')
+    self.checkpoint_path = checkpoint_path
+    self._model = None
+    self.tracer = Tracer(args.get("trace"), args.get("profile")).install()
+    self.catalog = Catalog(self.outputdir)
+    self.run_dir = None
+    self.progress = None # optional callable receiving (stage, details) events
+
+    with self.tracer.span("config"):
+      self.config = load_config('./PocketGen/configs/train_model.yml')
     
     if self.verbose > 0:
       print('Flint setup started, please wait.')
@@ -42,56 +95,158 @@ class Model:
       print('Now initializing pytorch and CUDA environment :')
 
     # cleans cache and sets the libs seeds
-    torch.cuda.empty_cache()
-    seed_all(2089)
+    with self.tracer.span("torch"):
+      torch.cuda.empty_cache()
+      seed_all(self.seed)
+
+      # inter-op threads can only be set before the first parallel operation
+      if self.threads > 0:
+        torch.set_num_threads(self.threads)
+      if self.interop_threads > 0:
+        torch.set_num_interop_threads(self.interop_threads)
 
     if self.verbose == 2:
       print('\tpytorch and CUDA initialized correctly.')
       print('Now retrieving alphabet from fair-ESM :')
 
-    # sets ESM2 alphabet as the usual alphabet
-    pretrained_model, self.alphabet = esm.pretrained.load_model_and_alphabet_hub('esm2_t33_650M_UR50D')
-    del pretrained_model # ESM2 pretrained_model that we don't need here is deleted from memory
+    # ESM2 models use the ESM-1b alphabet, no need to load the 650M weights for it
+    with self.tracer.span("alphabet"):
+      self.alphabet = esm.data.Alphabet.from_architecture('ESM-1b')
+
+    # turns a list of feature dicts into a batch
+    self.collate = partial(
+      collate_mols_block, # core of the batching process
+      batch_converter=self.alphabet.get_batch_converter()
+    )
 
     if self.verbose == 2:
       print('\tESM alphabet successfully loaded.')
+      print('End of setup, PocketGen will be built on first use.\n\n')
+
+
+  @property
+  def model(self) -> Pocket_Design_new:
+    """
+    The PocketGen instance, built from the checkpoint on first access.
+    @return (Pocket_Design_new): the model, with the checkpoint weights, on the selected device.
+    """
+
+    if self._model is None:
+      self._model = self._load_model()
+    return self._model
+
+
+  def _load_model(self, precision:"str | None"=None, compile_model:"bool | None"=None) -> Pocket_Design_new:
+    """
+    Loads the checkpoint and returns a PocketGen instance using its weights.
+    @param precision (str | None): "fp32", "bf16" or "int8", the configured one by default.
+    @param compile_model (bool | None): whether submodules are compiled, the configured choice by default.
+    @return (Pocket_Design_new): the model, on the selected device.
+    """
+
+    if self.verbose == 2:
       print('Now building PocketGen model :')
 
     # get the model checkpoint from .pt file
-    self.checkpoint = torch.load(checkpoint_path, map_location=self.device)
+    with self.tracer.span("checkpoint"):
+      checkpoint = torch.load(self.checkpoint_path, map_location=self.device)
 
     if self.verbose == 2:
       print('\tcheckpoint successfully created.')
 
     # instanciate PocketGen model for pocket design
-    self.model = Pocket_Design_new(
-      self.config.model,
-      protein_atom_feature_dim=FeaturizeProteinAtom().feature_dim,
-      ligand_atom_feature_dim=FeaturizeLigandAtom().feature_dim,
-      device=self.device
-    )
+    with self.tracer.span("instantiation"):
+      model = Pocket_Design_new(
+        self.config.model,
+        protein_atom_feature_dim=FeaturizeProteinAtom().feature_dim,
+        ligand_atom_feature_dim=FeaturizeLigandAtom().feature_dim,
+        device=self.device
+      )
 
     if self.verbose == 2:
       print("\tPocketGen model well instanciated.")
 
     # send model to selected device
-    self.model = self.model.to(self.device)
+    with self.tracer.span("to_device"):
+      model = model.to(self.device)
 
     if self.verbose == 2:
       print('\tPocketGen model sent to selected device.')
 
     # load current saved checkpoint into model
-    self.model.load_state_dict(self.checkpoint['model'])
+    with self.tracer.span("load_state_dict"):
+      model.load_state_dict(checkpoint['model'])
 
     if self.verbose == 2:
       print('\tcheckpoint loaded into PocketGen.')
+
+    with self.tracer.span("optimization"):
+      model = self._optimize(model.eval(), precision or self.precision, self.compile if compile_model is None else compile_model)
+
+    if self.verbose == 2:
       print('End of setup, model can now be used.\n\n')
+
+    return model
+
+
+  def _optimize(self, model:Pocket_Design_new, precision:str, compile_model:bool) -> Pocket_Design_new:
+    """
+    Applies the inference optimizations : int8 dynamic quantization of the 
+    linear layers (bf16 is applied by autocast, see _inference), and the 
+    compilation of the top-level submodules.
+    @param model (Pocket_Design_new): the model, with its weights.
+    @param precision (str): "fp32", "bf16" or "int8".
+    @param compile_model (bool): whether the submodules are compiled with torch.compile.
+    @return (Pocket_Design_new): the optimized model.
+    """
+
+    if precision == "int8":
+      if torch.device(self.device).type != "cpu":
+        raise ValueError("int8 dynamic quantization is only available on cpu")
+      model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    # generate() is a sampling loop writing files, only the networks it calls are compiled
+    if compile_model:
+      for name, child in list(model.named_children()):
+        setattr(model, name, torch.compile(child, dynamic=True))
+
+    return model
+
+
+  def _inference(self, precision:"str | None"=None) -> ExitStack:
+    """
+    Opens the context of an inference pass : inference mode on cpu, no_grad 
+    otherwise, and bf16 autocast of the linear layers and matmuls if selected.
+    @param precision (str | None): "fp32", "bf16" or "int8", the configured one by default.
+    @return (ExitStack): the context, to be used in a with statement.
+    """
+
+    device_type = torch.device(self.device).type
+    stack = ExitStack()
+    stack.enter_context(torch.inference_mode() if device_type == "cpu" else torch.no_grad())
+    if (precision or self.precision) == "bf16":
+      stack.enter_context(torch.autocast(device_type, dtype=torch.bfloat16))
+    return stack
   
 
+  def _docking_pool(self) -> ExitStack:
+    """
+    Opens one docking process pool, shared by the dockings run inside the 
+    context instead of one pool per call (see dock_all).
+    @return (ExitStack): the context, to be used in a with statement.
+    """
+
+    stack = ExitStack()
+    if self.workers > 1 and self.work_queue is None and self.pool is None:
+      self.pool = stack.enter_context(docking_pool(self.workers))
+      stack.callback(setattr, self, "pool", None)
+    return stack
+
+
   def input(self, receptor_path:str, ligand_path:str) -> "Model":
     """
-    Loads a protein receptor and a ligand from files and store it in 
-    a data-loader, useable by the model when generating mutants.
+    Loads a protein receptor and a ligand from files and stores their 
+    interaction features, collated into batches when generating mutants.
     @param ligand_path (str): path to the ligand SDF file.
     @param receptor_path (str): path to the receptor PDB file.
     @return (Model): the instance of Model, for chainability purposes.
@@ -101,30 +256,18 @@ class Model:
       print('Now parsing data from receptor and ligand :')
     
     # get dense features from receptor-ligand interaction
-    features = interaction(receptor_path, ligand_path)
+    with self.tracer.span("featurization", profile=True, receptor=receptor_path):
+      features = interaction(receptor_path, ligand_path, cachedir=self.features_cache, max_entries=self.features_cache_size)
 
     if self.verbose == 2:
       print('\tsuccessfully parsed interaction features.\n')
-      print('Now building the pytorch dataloader :')
-
-    # initialize the data loader (including batch converter)
-    self.loader = DataLoader(
-      [features for _ in range(self.size)],
-      batch_size=1, 
-      shuffle=False,
-      num_workers=self.config.train.num_workers,
-      collate_fn=partial( # use multiprocessing to parallelize
-        collate_mols_block, # core of the batching process
-        batch_converter=self.alphabet.get_batch_converter()
-      )
-    )
+
+    # keep a single copy of the features, batches are collated on demand
+    self.features = features
 
     # stores the source input files to compare
     self.sources = [receptor_path, ligand_path]
 
-    if self.verbose == 2:
-      print('\tpytorch dataloader built correctly.')
-
     return self
 
   
@@ -141,126 +284,1094 @@ class Model:
     self.model.eval()
 
     # creates the inference directory
-    n_runs = self._nruns()
-    run_dir = os.path.join(self.outputdir, f"run_{n_runs}")
-    os.makedirs(run_dir)
+    run_dir = self._new_run(self.sources, self.size)
+    self.run_dir = run_dir
+    target = {"features": self.features, "run_dir": run_dir, "number": self.size}
 
     # no need to compute gradients during inference
-    with torch.no_grad():
-      for b, batch in enumerate(self.loader):
-        # move batch to selected device
-        batch = {k: v.to(self.device) if isinstance(v, torch.Tensor) else v for k, v in batch.items()}
+    start = time.perf_counter()
+    with self._inference():
+      self._generate_targets([target])
 
-        # starts the inference for a single mutant
-        self.model.generate(
-          batch, target_path=os.path.join(run_dir, f"mutant_{b}")
-        )
-        
-        if self.verbose > 0:
-          print(f"\tinference done on a batch.")
-        
-    # stores the original input files for comparison
-    os.makedirs(os.path.join(run_dir, "original"), exist_ok=True)
-    shutil.copyfile(self.sources[0], os.path.join(run_dir, "original", "orig_receptor.pdb"))
-    shutil.copyfile(self.sources[1], os.path.join(run_dir, "original", "orig_ligand.sdf"))
-
-    # write inputs details to a local file
-    with open(os.path.join(run_dir, "inputs.txt"), "w") as file:
-      file.write(f"RECEPTOR: {self.sources[0]}\nLIGAND: {self.sources[1]}")
+    self._store_seeds(run_dir, target, time.perf_counter() - start)
 
     return self
+
+
+  def generate_many(self, targets:"list[tuple[str, str, int]]") -> "list[str]":
+    """
+    Generates mutants for several receptor-ligand pairs with a single loaded model. 
+    Samples of every target are pooled, so that pockets of similar sizes share 
+    inference batches, then written to one run directory per target.
+    @param targets (list[tuple[str, str, int]]): (receptor_path, ligand_path, number) triples.
+    @return (list[str]): the run directory of each target, in order.
+    """
+
+    if self.verbose > 0:
+      print(f"Now generating new mutant protein receptors for {len(targets)} targets :")
+
+    self.model.eval()
+    runs = []
+
+    for receptor_path, ligand_path, number in targets:
+      with self.tracer.span("featurization", profile=True, receptor=receptor_path):
+        features = interaction(receptor_path, ligand_path, cachedir=self.features_cache, max_entries=self.features_cache_size)
+      runs.append({"features": features, "run_dir": self._new_run([receptor_path, ligand_path], number), "number": number})
+
+    # the generation time is shared by the targets, as are the batches
+    start = time.perf_counter()
+    with self._inference():
+      self._generate_targets(runs)
+    generation_wall = time.perf_counter() - start
+
+    for target in runs:
+      self._store_seeds(target["run_dir"], target, generation_wall)
+
+    runs = [target["run_dir"] for target in runs]
+    self.run_dir = runs[-1] if runs else None
+    return runs
   
   
-  def results(self) -> "Model":
+  def results(self, runs:"list[str] | None"=None) -> "Model":
     """
     write results in a summary file, along with all generated PDBs.
+    @param runs (list[str] | None): the run directories to score, all of them by default.
     @return (Model): the instance of Model, for chainability purposes.
     """
 
     if self.verbose > 0:
       print(f"Now writing output files :")
+
+    if runs is None:
+      runs = self.catalog.runs("generated")
     
-    for run in range(self._nruns()):
-      run_dir = os.path.join(self.outputdir, f"run_{run}")
-      
-      if os.path.isfile(os.path.join(run_dir, "summary.tsv")):
-        continue
+    # one docking pool scores every run
+    with self._docking_pool():
+      for run_dir in runs:
+        # runs with failed dockings are scored again, the others are over
+        journal = Journal(run_dir)
+        if os.path.isfile(os.path.join(run_dir, "summary.tsv")) and not (journal.failures("dock") or journal.failures("triage")):
+          continue
 
-      # initialize the resulting summary TSV
-      summary = "ID\tdelta_G\tKd\tmutations (AA)\n"
+        inputs = _read_inputs(run_dir)
+        if "NUMBER" in inputs and "SEEDS" not in inputs:
+          print(f"\t{os.path.basename(run_dir)} generation was interrupted, it can be completed with --resume.")
+          continue
 
-      # write original inputs docking in summary
-      src_mean_dg, src_mean_kd = self._dock(
-        os.path.join(run_dir, "original", f"orig_receptor.pdb"),
-        os.path.join(run_dir, "original", "orig_ligand.sdf")
-      )
+        # results of an interrupted scoring are read back from the journal
+        done = journal.scores("dock")
+        triaged = journal.scores("triage")
+
+        # the original inputs are docked along with the mutants, duplicates are not
+        start = time.perf_counter()
+        names, jobs = self._jobs(run_dir, range(self._nbatches(run_dir)))
+        duplicates = _read_duplicates(run_dir)
+        docked = [i for i, name in enumerate(names) if name not in duplicates]
+        pending = [i for i in docked if names[i] not in done or (self.screen and names[i] not in triaged)]
+
+        boxes = [self.box] * len(jobs)
+        if self.box is None:
+          with self.tracer.span("compute_box", profile=True, run=run_dir, boxes=len(pending)):
+            for i, box in zip(pending, compute_boxes([jobs[i][0] for i in pending], [jobs[i][1] for i in pending])):
+              boxes[i] = box
+
+        # a cheap first pass decides which mutants deserve a full docking
+        triage, selected = None, docked
+        if self.screen is not None:
+          triage, selected = self._triage(names, jobs, boxes, docked, journal)
+
+          if self.verbose > 0:
+            print(f"\ttriage kept {len(selected) - 1} of {len(docked) - 1} mutants for full docking.")
 
-      summary += f"original\t{src_mean_dg}\t{src_mean_kd}\t0" + "\n"
+        # failures are not results, resuming the run docks them again
+        def on_docked(i, score):
+          if score is None:
+            journal.append("failed", id=names[i], of="dock")
+            self._notify("docking", {"run": run_dir, "id": names[i], "delta_G": None})
+            return
+          journal.append("dock", id=names[i], delta_G=float(score[0]), Kd=float(score[1]), energies=score[2])
+          self._notify("docking", {"run": run_dir, "id": names[i], "delta_G": float(score[0])})
 
-      for b in range(self._nbatches(run_dir)):
-        receptor_path = os.path.join(run_dir, f"mutant_{b}", f"{b}_whole.pdb")
-        ligand_path = os.path.join(run_dir, f"mutant_{b}", f"{b}.sdf")
+        todo = [i for i in selected if names[i] not in done]
+        docking_start = time.perf_counter()
+        with self.tracer.span("docking", run=run_dir, jobs=len(todo), workers=self.workers):
+          full = self._dock_all([jobs[i] for i in todo], [boxes[i] for i in todo], 
+            callback=lambda j, score: on_docked(todo[j], score))
+        docking_time = time.perf_counter() - docking_start
 
-        mean_dg, mean_kd = self._dock(receptor_path, ligand_path)
+        if self.pocket_validate and self.pocket_radius is not None and todo:
+          self._validate_pocket(run_dir, [names[i] for i in todo], [jobs[i] for i in todo], 
+            [boxes[i] for i in todo], full, docking_time)
 
-        # find the number of mutations (AA-level)
-        n_mutations = mutations(
-          os.path.join(run_dir, "original", f"orig_receptor.pdb"),
-          receptor_path
+        scores = [done.get(name) for name in names]
+        poses = journal.energies("dock")
+        for i, score in zip(todo, full):
+          scores[i] = score
+          if score is not None:
+            poses[names[i]] = score[2]
+        scores = self._score_poses(run_dir, names, scores, poses)
+
+        # duplicates share the scores of the mutant they duplicate
+        scores = _link_duplicates(names, scores, duplicates)
+        triage = triage and _link_duplicates(names, triage, duplicates)
+
+        # the summary is written anyway, the run stays to be completed
+        failed = journal.failures("dock") | journal.failures("triage")
+        self._write_summary(run_dir, names, jobs, scores, triage)
+        self.catalog.set_status(run_dir, "generated" if failed else "done", docking_time=time.perf_counter() - start)
+
+        if self.verbose > 0:
+          print(f"You can find the {os.path.basename(run_dir)} summary in your output folder.")
+          if failed:
+            print(f"\t{len(failed)} dockings failed, --resume docks them again.")
+
+    return self
+  
+
+  def pipeline(self) -> "Model":
+    """
+    Generates mutants and docks them at the same time : every mutant is sent 
+    to the docking workers as soon as it is written, through a bounded queue 
+    that holds generation back when docking falls behind.
+    @return (Model): the instance of Model, for chainability purposes.
+    """
+
+    if self.verbose > 0:
+      print("Now generating and docking new mutant protein receptors :")
+
+    self.model.eval()
+    run_dir = self._new_run(self.sources, self.size)
+    self.run_dir = run_dir
+    target = {"features": self.features, "run_dir": run_dir, "number": self.size}
+    journal = Journal(run_dir)
+
+    with DockingPipeline(self.workers, cpu=self.vina_cpu, seed=self.seed, cache=self.docking_cache, 
+      queue_size=self.queue_size, scratch=self.scratch, pocket_radius=self.pocket_radius, 
+      verbose=self.verbose) as docking_pipeline:
+
+      # every result is journaled as soon as its docking is over
+      def on_docked(name, future):
+        score = future.result() if future.exception() is None else None
+        if score is None:
+          journal.append("failed", id=name, of="dock")
+        else:
+          journal.append("dock", id=name, delta_G=float(score[0]), Kd=float(score[1]), energies=score[2])
+
+      # in memory, the workers get the file contents read right after generation
+      def submit(name, job, blocks=None):
+        futures[name] = docking_pipeline.submit_blocks(*blocks) if blocks else docking_pipeline.submit(*job)
+        futures[name].add_done_callback(partial(on_docked, name))
+
+      # the original is docked while the first batch is generated
+      futures = {}
+      original = _read_blocks(*self.sources) if self.in_memory else None
+      submit("original", self._jobs(run_dir, [])[1][0], original)
+
+      def on_sample(sample):
+        names, jobs = self._jobs(run_dir, [sample["index"]])
+        blocks = sample.pop("blocks", None)
+        if names[1] not in target["duplicates"]:
+          submit(names[1], jobs[1], blocks)
+
+      start = time.perf_counter()
+      with self._inference():
+        self._generate_targets([target], on_sample=on_sample)
+      generation_wall = time.perf_counter() - start
+
+      names, jobs = self._jobs(run_dir, range(target["next"]))
+      scores = [futures[name].result() if name in futures else None for name in names]
+      scores = self._score_poses(run_dir, names, scores, {name: score[2] for name, score in zip(names, scores) if score})
+      scores = _link_duplicates(names, scores, target["duplicates"])
+      utilization = docking_pipeline.utilization()
+
+    # generation is busy whenever it is not waiting for a docking slot
+    generation_busy = generation_wall - utilization["blocked"]
+
+    self._store_seeds(run_dir, target, generation_wall)
+    sequences = None
+    if self.in_memory:
+      sequences = [parse_sequence(original[0].splitlines())] + [target["sequences"].get(name, {}) for name in names[1:]]
+    failed = journal.failures("dock")
+    self._write_summary(run_dir, names, jobs, scores, duplicates=target["duplicates"], sequences=sequences)
+    self.catalog.set_status(run_dir, "generated" if failed else "done", docking_time=utilization["wall"])
+
+    if self.verbose > 0:
+      print(f"You can find the {os.path.basename(run_dir)} summary in your output folder.")
+      if failed:
+        print(f"\t{len(failed)} dockings failed, --resume docks them again.")
+      print("Pipeline utilization :")
+      print(f"\tgeneration : busy {generation_busy:.1f}s, "
+        f"{100 * generation_busy / utilization['wall']:.0f}% of {utilization['wall']:.1f}s, "
+        f"blocked {utilization['blocked']:.1f}s on the docking queue")
+      print(f"\tdocking : busy {utilization['docking_busy']:.1f}s over {self.workers} workers, "
+        f"{100 * utilization['docking']:.0f}% utilization")
+
+    return self
+
+
+  def resume(self) -> "Model":
+    """
+    Completes the generation of the runs that were interrupted, starting 
+    from the last mutant written in their journal. Their docking is then 
+    resumed by results(), which skips the jobs already journaled.
+    @return (Model): the instance of Model, for chainability purposes.
+    """
+
+    for run_dir in self.catalog.runs("generating"):
+      inputs = _read_inputs(run_dir)
+      if "NUMBER" not in inputs or "SEEDS" in inputs:
+        continue
+
+      if self.verbose > 0:
+        print(f"Now resuming the generation of {os.path.basename(run_dir)} :")
+
+      # the copies of the inputs are used, the original paths may be gone
+      target = self._restore_target(run_dir, int(inputs["NUMBER"]))
+      with self.tracer.span("featurization", profile=True, receptor=inputs["RECEPTOR"]):
+        target["features"] = interaction(
+          os.path.join(run_dir, "original", "orig_receptor.pdb"),
+          os.path.join(run_dir, "original", "orig_ligand.sdf"),
+          cachedir=self.features_cache, max_entries=self.features_cache_size
         )
 
-        summary += f"mutant_{b}\t{mean_dg}\t{mean_kd}\t{n_mutations}" + "\n"
+      self.model.eval()
+      start = time.perf_counter()
+      with self._inference():
+        self._generate_targets([target], offset=target["attempts"])
+      self._store_seeds(run_dir, target, time.perf_counter() - start)
+
+    return self
 
-        if self.verbose == 2:
-          print(f"\twrote one new entry in the summary file.")
-      
-      # write summary to a local file
-      with open(os.path.join(run_dir, "summary.tsv"), "w") as file:
-        file.write(summary)
 
+  def campaign(self, receptor_path:str, ligand_path:str, rounds:int, top:int=1) -> "list[dict]":
+    """
+    Runs several design rounds in one process : each round generates mutants 
+    of every parent, one run per parent, and the top mutants by deltaG become 
+    the parents of the next round. Parents are featurized incrementally from 
+    the receptor they were generated from, every round is docked in the box of 
+    the input receptor, and parents are not docked again. The selected mutants 
+    are listed in campaign.tsv, in the output folder.
+    @param receptor_path (str): path to the receptor PDB file of the first round.
+    @param ligand_path (str): path to the ligand SDF file, shared by every round.
+    @param rounds (int): the number of design rounds.
+    @param top (int): the number of mutants kept as parents after each round.
+    @return (list[dict]): the selected mutants of every round.
+    """
+
+    self.model.eval()
+    self.sources = [receptor_path, ligand_path]
+
+    with self.tracer.span("featurization", profile=True, receptor=receptor_path):
+      features, frame = interaction_frame(receptor_path, ligand_path)
+    with self.tracer.span("compute_box", receptor=receptor_path):
+      self.box = compute_box(receptor_path, ligand_path)
+
+    parents = [{"features": features, "frame": frame, "score": None, "energies": None, "id": "input"}]
+    selected, runs = [], []
+
+    for k in range(rounds):
       if self.verbose > 0:
-        print(f"You can find the run #{run} summary in your output folder.")
+        print(f"Campaign round {k + 1} of {rounds}, {len(parents)} parents :")
+
+      targets = [{"features": parent["features"], "number": self.size,
+        "run_dir": self._new_run([parent["frame"]["receptor_path"], ligand_path], self.size)} for parent in parents]
+
+      start = time.perf_counter()
+      with self._inference():
+        self._generate_targets(targets)
+      generation_wall = time.perf_counter() - start
+
+      # parents were docked by the previous round, in the same box
+      for target, parent in zip(targets, parents):
+        self._store_seeds(target["run_dir"], target, generation_wall)
+        if parent["score"] is not None:
+          Journal(target["run_dir"]).append("dock", id="original", delta_G=parent["score"][0], Kd=parent["score"][1], 
+            energies=parent["energies"])
+
+      runs = [target["run_dir"] for target in targets]
+      self.results(runs)
+
+      # lower energies bind better, by the selected statistic of the poses
+      candidates = [(score, run_dir, parent, name) for run_dir, parent in zip(runs, parents)
+        for name, score in self._run_scores(run_dir).items() if name != "original"]
+      candidates = sorted(candidates, key=lambda candidate: candidate[0][0])[:top]
+
+      parents = []
+      for score, run_dir, parent, name in candidates:
+        receptor = os.path.join(run_dir, name, f"{name[len('mutant_'):]}_whole.pdb")
+        with self.tracer.span("featurization", profile=True, receptor=receptor, incremental=True):
+          features, frame = update_interaction(parent["frame"], receptor)
+        parents.append({"features": features, "frame": frame, "score": score, "id": f"{os.path.basename(run_dir)}/{name}",
+          "energies": Journal(run_dir).energies("dock").get(name)})
+        selected.append({"round": k + 1, "id": parents[-1]["id"], "parent": parent["id"], 
+          "delta_G": float(score[0]), "Kd": float(score[1]), "receptor": receptor})
+
+      self._write_campaign(selected)
+      if not parents:
+        break
+
+      if self.verbose > 0:
+        print(f"\tround {k + 1} best mutant {parents[0]['id']} : {parents[0]['score'][0]:.3f} kcal/mol.")
+
+    self.box = None
+    self.run_dir = runs[-1] if runs else None
+    return selected
+
+
+  def rerank(self, runs:"list[str] | None"=None) -> "Model":
+    """
+    Scores finished runs again with the selected statistic of their pose 
+    energies (energies.npz), then rewrites their summary file and catalog 
+    scores, without docking them again.
+    @param runs (list[str] | None): the run directories to rank, all finished ones by default.
+    @return (Model): the instance of Model, for chainability purposes.
+    """
+
+    for run_dir in runs if runs is not None else self.catalog.runs("done"):
+      if not os.path.isfile(os.path.join(run_dir, "energies.npz")):
+        print(f"\t{os.path.basename(run_dir)} has no pose energies and cannot be ranked again.")
+        continue
+
+      # the triage pass is kept, its poses are not
+      names, jobs = self._jobs(run_dir, range(self._nbatches(run_dir)))
+      duplicates = _read_duplicates(run_dir)
+      found = self._run_scores(run_dir)
+      triaged = Journal(run_dir).scores("triage")
+      scores = _link_duplicates(names, [found.get(name) for name in names], duplicates)
+      triage = _link_duplicates(names, [triaged[name][0] if name in triaged else None for name in names], duplicates) if triaged else None
+
+      self._write_summary(run_dir, names, jobs, scores, triage)
+      if self.verbose > 0:
+        print(f"\t{os.path.basename(run_dir)} ranked by {self.statistic} deltaG.")
 
     return self
-  
 
-  def _dock(self, receptor_path, ligand_path):
 
-    # compute the docking window around ligand
-    docking_box = compute_box(receptor_path, ligand_path)
+  def compare_precision(self, repeat:int=2) -> dict:
+    """
+    Generates the same batch from the input, with the same seed, with the fp32 
+    model and with the configured precision and compilation, then compares 
+    their speed and their outputs : residue identity and atom coordinates 
+    RMSD of each mutant. The report is written to precision_comparison.json.
+    @param repeat (int): the number of timed passes of each model, the first one includes compilation.
+    @return (dict): the timings of both models, the speedup and the agreement of each mutant.
+    """
+
+    compare_dir = os.path.join(self.outputdir, "precision_comparison")
+    report = {}
 
-    try:
-      energies = docking(
-        receptor_file=prepare(receptor_path),
-        ligand_file=prepare(ligand_path),
-        center=docking_box["center"],
-        box_size=docking_box["size"],
-        verbosity=self.verbose
-      )
-    except Exception as e:
-      print(f"\t\terror simulating docking: {e}")
-      energies = np.zeros(1)
+    for name, precision, compile_model in (("fp32", "fp32", False), ("optimized", self.precision, self.compile)):
+      model = self._load_model(precision, compile_model)
+      shutil.rmtree(os.path.join(compare_dir, name), ignore_errors=True)
+      walls = []
+
+      for _ in range(repeat):
+        seed_all(self.seed)
+        batch = self.collate([self.features] * self.size)
+        batch = {k: v.to(self.device) if isinstance(v, torch.Tensor) else v for k, v in batch.items()}
+
+        start = time.perf_counter()
+        with self._inference(precision):
+          model.generate(batch, target_path=os.path.join(compare_dir, name))
+        walls.append(time.perf_counter() - start)
+
+      report[name] = {"precision": precision, "compile": compile_model, "first": walls[0], "best": min(walls)}
+      del model
+
+    report["speedup"] = report["fp32"]["best"] / report["optimized"]["best"]
+    report["mutants"] = []
+    # each pass writes the batch again, the last one is compared
+    stems = [_batch_stems(os.path.join(compare_dir, name))[-self.size:] for name in ("fp32", "optimized")]
+    for fp32, optimized in zip(*stems):
+      paths = [os.path.join(compare_dir, name, f"{stem}_whole.pdb") for name, stem in (("fp32", fp32), ("optimized", optimized))]
+      sequences = [get_sequence(path) for path in paths]
+      coordinates = [load_coordinates(path) for path in paths]
+      report["mutants"].append({
+        "residue_identity": 1 - len(diff(*sequences)) / max(1, len(sequences[0])),
+        "rmsd": float(np.sqrt(((coordinates[0] - coordinates[1]) ** 2).sum(axis=1).mean())) 
+          if coordinates[0].shape == coordinates[1].shape else None
+      })
+
+    with open(os.path.join(compare_dir, "precision_comparison.json"), "w") as file:
+      json.dump(report, file, indent=2)
 
-    # calculates the mean Kd and deltaG
-    return np.mean(energies), np.mean([kd(e) for e in energies])
+    if self.verbose > 0:
+      rmsds = [mutant["rmsd"] for mutant in report["mutants"] if mutant["rmsd"] is not None]
+      print(f"fp32 : {report['fp32']['best']:.2f}s per batch of {self.size} (first pass {report['fp32']['first']:.2f}s)")
+      print(f"{self.precision}{' compiled' * self.compile} : {report['optimized']['best']:.2f}s per batch "
+        f"(first pass {report['optimized']['first']:.2f}s), {report['speedup']:.2f}x")
+      print(f"mean residue identity {np.mean([m['residue_identity'] for m in report['mutants']]):.3f}, "
+        f"mean RMSD {np.mean(rmsds) if rmsds else float('nan'):.3f} A")
+
+    return report
+
+
+  def _restore_target(self, run_dir:str, number:int) -> dict:
+    """
+    Rebuilds the generation state of an interrupted run from its journal, 
+    and removes the outputs of the batch that was being written.
+    @param run_dir (str): the run directory.
+    @param number (int): the number of mutants requested for the run.
+    @return (dict): the target, as filled by _generate_targets.
+    """
+
+    entries = Journal(run_dir).entries("generation")
+    kept = [entry for entry in entries if entry["id"] is not None]
+    target = {
+      "run_dir": run_dir,
+      "number": number,
+      "next": len(kept),
+      "attempts": len(entries),
+      "seeds": [entry["seed"] for entry in kept],
+      "batches": [f"{entry.get('batch_size', '?')}:{entry.get('position', '?')}" for entry in kept],
+      "duplicates": {entry["id"]: entry["duplicate_of"] for entry in kept if entry.get("duplicate_of")},
+      "seen": {}
+    }
+
+    for name in os.listdir(run_dir):
+      if name.startswith(".batch_") or (name.startswith("mutant_") and int(name[7:]) >= target["next"]):
+        shutil.rmtree(os.path.join(run_dir, name))
+
+    for b in range(target["next"]):
+      if f"mutant_{b}" not in target["duplicates"]:
+        target["seen"][_pocket_hash(os.path.join(run_dir, f"mutant_{b}", f"{b}_whole.pdb"))] = f"mutant_{b}"
+
+    return target
+
+
+  def _triage(
+    self, 
+    names:"list[str]",
+    jobs:"list[tuple[str, str]]", 
+    boxes:"list[dict]", 
+    candidates:"list[int]",
+    journal:Journal) -> "tuple[list[float | None], list[int]]":
+    """
+    Ranks the jobs of a run with a cheap docking pass, then selects the 
+    original and the best mutants, by rank (screen_top) and / or by energy 
+    margin over the original (screen_threshold).
+    @param names (list[str]): the summary ID of each job.
+    @param jobs (list[tuple[str, str]]): the (receptor, ligand) paths, original first.
+    @param boxes (list[dict]): the docking window of each job.
+    @param candidates (list[int]): the indexes of the jobs to rank, original (0) first.
+    @param journal (Journal): the run journal, holding the jobs already ranked.
+    @return (tuple[list[float | None], list[int]]): the triage deltaG of each job and the selected job indexes.
+    """
+
+    triaged = journal.scores("triage")
+    energies = [triaged[name][0] if name in triaged else None for name in names]
+    todo = [i for i in candidates if names[i] not in triaged]
+
+    def on_triaged(i, score):
+      if score is None:
+        journal.append("failed", id=names[i], of="triage")
+        return
+      energies[i] = float(score[0])
+      journal.append("triage", id=names[i], delta_G=float(score[0]), Kd=float(score[1]))
+
+    with self.tracer.span("triage", jobs=len(todo), workers=self.workers, mode=self.screen):
+      self._dock_all([jobs[i] for i in todo], [boxes[i] for i in todo], n_dockings=self.screen_exhaustiveness,
+        mode="optimize" if self.screen == "optimize" else "dock", callback=lambda j, score: on_triaged(todo[j], score))
+
+    # lower energies bind better, mutants that failed are left out until resumed
+    mutants = sorted([i for i in candidates[1:] if energies[i] is not None], key=lambda i: energies[i])
+    if self.screen_top:
+      mutants = mutants[:self.screen_top]
+    if self.screen_threshold is not None and energies[0] is not None:
+      mutants = [i for i in mutants if energies[i] <= energies[0] + self.screen_threshold]
+
+    return energies, [0] + sorted(mutants)
+
+
+  def _dock_all(self, jobs:"list[tuple[str, str]]", boxes:"list[dict]", **kwargs) -> "list[tuple[float, float, list[float]] | None]":
+    """
+    Docks jobs with the local process pool, or through the work queue when one is set.
+    @param jobs (list[tuple[str, str]]): (receptor_path, ligand_path) pairs.
+    @param boxes (list[dict]): the docking window of each job.
+    @param kwargs: n_dockings, mode, pocket_radius and callback, see dock_all.
+    @return (list[tuple[float, float, list[float]] | None]): the (deltaG, Kd, pose energies) of each job, in the jobs order, None if its docking failed.
+    """
+
+    kwargs.setdefault("pocket_radius", self.pocket_radius)
+    if self.work_queue is not None:
+      return dock_queued(jobs, self.work_queue, seed=self.seed, boxes=boxes, verbose=self.verbose, **kwargs)
+    return dock_all(jobs, workers=self.workers, cpu=self.vina_cpu, seed=self.seed, 
+      cache=self.docking_cache, boxes=boxes, pool=self.pool, verbose=self.verbose, **kwargs)
+
+
+  def _validate_pocket(
+    self,
+    run_dir:str,
+    names:"list[str]",
+    jobs:"list[tuple[str, str]]",
+    boxes:"list[dict]",
+    scores:"list[tuple[float, float]]",
+    docking_time:float) -> dict:
+    """
+    Docks the whole receptors of jobs already docked truncated, then reports
+    the deviation of the truncated scores. The report is written to 
+    pocket_validation.json in the run directory.
+    @param run_dir (str): the run directory.
+    @param names (list[str]): the summary ID of each job.
+    @param jobs (list[tuple[str, str]]): the (receptor, ligand) paths of each job.
+    @param boxes (list[dict]): the docking window of each job.
+    @param scores (list[tuple[float, float]]): the (deltaG, Kd) of each job, docked truncated.
+    @param docking_time (float): the seconds spent docking the truncated receptors.
+    @return (dict): the deviation of each job, their mean and maximum, and both docking times.
+    """
+
+    start = time.perf_counter()
+    with self.tracer.span("pocket_validation", run=run_dir, jobs=len(jobs)):
+      whole = self._dock_all(jobs, boxes, pocket_radius=None)
+
+    # only the jobs docked both ways are compared
+    kept = [k for k in range(len(jobs)) if scores[k] is not None and whole[k] is not None]
+    names, jobs, scores, whole = ([values[k] for k in kept] for values in (names, jobs, scores, whole))
+    if not kept:
+      return {}
+
+    pocket_energies = np.array([float(score[0]) for score in scores])
+    whole_energies = np.array([float(score[0]) for score in whole])
+    deviations = pocket_energies - whole_energies
+
+    # the ranking decides which mutants are kept, its agreement matters more than the values
+    ranks = [np.argsort(np.argsort(energies)) for energies in (pocket_energies, whole_energies)]
+    report = {
+      "pocket_radius": self.pocket_radius,
+      "pocket_time": docking_time,
+      "whole_time": time.perf_counter() - start,
+      "mean_abs_deviation": float(np.mean(np.abs(deviations))),
+      "max_abs_deviation": float(np.max(np.abs(deviations))),
+      "rank_correlation": float(np.corrcoef(*ranks)[0, 1]) if len(jobs) > 2 else None,
+      "jobs": [{"id": name, "delta_G_pocket": float(pocket), "delta_G_whole": float(full), "deviation": float(deviation)}
+        for name, pocket, full, deviation in zip(names, pocket_energies, whole_energies, deviations)]
+    }
+
+    with open(os.path.join(run_dir, "pocket_validation.json"), "w") as file:
+      json.dump(report, file, indent=2)
+
+    if self.verbose > 0:
+      print(f"\ttruncated receptors ({self.pocket_radius:g} A) : mean deviation {report['mean_abs_deviation']:.3f} kcal/mol, "
+        f"max {report['max_abs_deviation']:.3f} kcal/mol, docked in {report['pocket_time']:.1f}s against {report['whole_time']:.1f}s.")
+    return report
+
+
+  def _score_poses(
+    self, 
+    run_dir:str, 
+    names:"list[str]", 
+    scores:list, 
+    poses:"dict[str, list[float]]") -> "list[tuple[float, float] | None]":
+    """
+    Writes the pose energies of a run to energies.npz, and scores each job with 
+    the selected statistic of its poses (see eval.affinity).
+    @param run_dir (str): the run directory.
+    @param names (list[str]): the summary ID of each job.
+    @param scores (list[tuple | None]): the docking result of each job, None if not docked.
+    @param poses (dict[str, list[float]]): the pose energies of the docked jobs, by summary ID.
+    @return (list[tuple[float, float] | None]): the (deltaG, Kd) of each job, jobs 
+    docked before their poses were journaled keep their mean score.
+    """
+
+    energies = [poses.get(name) if score else None for name, score in zip(names, scores)]
+    with self.tracer.span("affinity", run=run_dir, jobs=len(names), statistic=self.statistic):
+      save_energies(os.path.join(run_dir, "energies.npz"), names, energies)
+      delta_G, Kd = pose_score(pad(energies), self.statistic)
+
+    return [(float(delta_G[i]), float(Kd[i])) if energies[i] else score and (float(score[0]), float(score[1]))
+      for i, score in enumerate(scores)]
+
+
+  def _run_scores(self, run_dir:str) -> "dict[str, tuple[float, float]]":
+    """
+    Reads the docking results of a run, scored with the selected statistic.
+    @param run_dir (str): the run directory.
+    @return (dict[str, tuple[float, float]]): the (deltaG, Kd) of each docked ID.
+    """
+
+    found = Journal(run_dir).scores("dock")
+    if not os.path.isfile(os.path.join(run_dir, "energies.npz")):
+      return found
+
+    names, energies = load_energies(os.path.join(run_dir, "energies.npz"))
+    delta_G, Kd = pose_score(energies, self.statistic)
+    found.update({name: (float(delta_G[i]), float(Kd[i])) for i, name in enumerate(names) if not np.isnan(delta_G[i])})
+    return found
+
+
+  def _write_campaign(self, selected:"list[dict]") -> None:
+    """
+    Writes the mutants selected by the rounds of a campaign, see campaign.
+    @param selected (list[dict]): the round, id, parent, deltaG, Kd and receptor path of each mutant.
+    """
+
+    path = os.path.join(self.outputdir, "campaign.tsv")
+    with open(path + ".tmp", "w") as file:
+      file.write("ROUND\tID\tPARENT\tDELTA_G\tKD\tRECEPTOR\n")
+      file.write("".join(f"{row['round']}\t{row['id']}\t{row['parent']}\t{row['delta_G']}\t{row['Kd']}\t{row['receptor']}\n" 
+        for row in selected))
+    os.replace(path + ".tmp", path)
+
+
+  def _jobs(self, run_dir:str, mutants) -> "tuple[list[str], list[tuple[str, str]]]":
+    """
+    Lists the docking jobs of a run : the original inputs, then each mutant.
+    @param run_dir (str): the run directory.
+    @param mutants (iterable[int]): the mutant indexes.
+    @return (tuple[list[str], list[tuple[str, str]]]): the summary IDs and (receptor, ligand) paths.
+    """
+
+    names = ["original"] + [f"mutant_{b}" for b in mutants]
+    jobs = [(
+      os.path.join(run_dir, "original", "orig_receptor.pdb"),
+      os.path.join(run_dir, "original", "orig_ligand.sdf")
+    )]
+    jobs += [(
+      os.path.join(run_dir, f"mutant_{b}", f"{b}_whole.pdb"),
+      os.path.join(run_dir, f"mutant_{b}", f"{b}.sdf")
+    ) for b in mutants]
+    return names, jobs
+
+
+  def _write_summary(
+    self, 
+    run_dir:str, 
+    names:"list[str]", 
+    jobs:"list[tuple[str, str]]", 
+    scores:list, 
+    triage:"list[float] | None"=None,
+    duplicates:"dict[str, str] | None"=None,
+    sequences:"list[dict] | None"=None) -> None:
+    """
+    Writes the summary file of a run, with rows in the jobs order, and 
+    records its scores in the catalog.
+    @param run_dir (str): the run directory.
+    @param names (list[str]): the summary ID of each job.
+    @param jobs (list[tuple[str, str]]): the (receptor, ligand) paths of each job.
+    @param scores (list[tuple[float, float] | None]): the (deltaG, Kd) of each job, None if not docked.
+    @param triage (list[float] | None): the triage deltaG of each job, if screened.
+    @param duplicates (dict[str, str] | None): the mutant each duplicate is identical to.
+    @param sequences (list[dict] | None): the sequence of each job (see get_sequence), 
+    parsed from memory, the receptor files are read if None.
+    """
+
+    # initialize the resulting summary TSV
+    summary = "ID\tdelta_G\tKd\ttriage_delta_G\tmutations (AA)\tsequence of mutations\tduplicate of\n"
+    triage = [dg if dg is not None else "-" for dg in triage or [None] * len(jobs)]
+    duplicates = _read_duplicates(run_dir) if duplicates is None else duplicates
+
+    # find the mutations (AA-level) of every mutant, the original is parsed once
+    with self.tracer.span("mutations", profile=True, run=run_dir, mutants=len(jobs) - 1):
+      if sequences is None:
+        diffs = [[]] + mutations_batch(jobs[0][0], [receptor_path for receptor_path, _ in jobs[1:]])
+      else:
+        diffs = [diff(sequences[0], sequence) for sequence in sequences]
+
+    rows = []
+    for name, mutations, score, triage_dg in zip(names, diffs, scores, triage):
+      rows.append((name, *((float(score[0]), float(score[1])) if score else (None, None)),
+        None if triage_dg == "-" else float(triage_dg), ",".join(mutations)))
+      mean_dg, mean_kd = score or ("-", "-")
+      summary += f"{name}\t{mean_dg}\t{mean_kd}\t{triage_dg}\t{len(mutations)}\t{','.join(mutations) or '-'}\t{duplicates.get(name, '-')}" + "\n"
+
+      if self.verbose == 2:
+        print(f"\twrote one new entry in the summary file.")
+    
+    # write summary to a local file, its presence marks the run as complete
+    with open(os.path.join(run_dir, "summary.tsv.tmp"), "w") as file:
+      file.write(summary)
+    os.replace(os.path.join(run_dir, "summary.tsv.tmp"), os.path.join(run_dir, "summary.tsv"))
+    self.catalog.set_scores(run_dir, rows)
+
+
+  def _generate_targets(self, targets:"list[dict]", on_sample=None, offset:int=0) -> None:
+    """
+    Generates the mutants of several targets (see _generate_samples). Mutants 
+    whose pocket sequence was already produced for the same target are skipped 
+    or linked to the first one (dedup), and in unique mode, sampling goes on 
+    until every target has its number of unique mutants, within max_attempts 
+    samples per target. Each target dict is filled with its mutants count 
+    (next), seeds and duplicates.
+    @param targets (list[dict]): features, run_dir and number of mutants of each target, 
+    along with the state of a previous generation when resuming (see _restore_target).
+    @param on_sample (callable): called with each kept sample once its mutant is written.
+    @param offset (int): the number of samples generated before, to seed new ones.
+    """
+
+    for target in targets:
+      for key, value in {"next": 0, "attempts": 0, "seeds": [], "batches": [], "seen": {}, "duplicates": {}}.items():
+        target.setdefault(key, value)
+      target.setdefault("journal", Journal(target["run_dir"]))
+
+    pending = targets
+    while pending:
+      samples = []
+      for target in pending:
+        unique = target["next"] - len(target["duplicates"])
+        limit = self.max_attempts or 4 * target["number"]
+        if self.unique:
+          n = min(target["number"] - unique, limit - target["attempts"])
+        else:
+          n = target["number"] - target["attempts"]
+        samples += [{"features": target["features"], "target": target} for _ in range(n)]
+        target["attempts"] += n
+
+      if not samples:
+        break
+      self._generate_samples(samples, offset, on_sample)
+      offset += len(samples)
+
+      if not self.unique:
+        break
+
+      pending = [target for target in pending 
+        if target["next"] - len(target["duplicates"]) < target["number"] 
+        and target["attempts"] < (self.max_attempts or 4 * target["number"])]
+
+    if self.verbose > 0 and self.unique:
+      for target in targets:
+        unique = target["next"] - len(target["duplicates"])
+        if unique < target["number"]:
+          print(f"\tonly {unique} unique mutants found in {target['attempts']} attempts.")
 
 
-  def _nruns(self) -> int:
+  def _generate_samples(self, samples:"list[dict]", offset:int=0, on_sample=None) -> None:
     """
-    returns the number of inferences stored from now in the output directory
-    @return (int): the number of folders in dir
+    Generates one mutant per sample, batching samples whose pockets have 
+    similar sizes so that each batch is a single forward pass. In auto mode, 
+    the batch size starts at the number of samples and is halved every time 
+    the device runs out of memory.
+    @param samples (list[dict]): features and target of each sample.
+    @param offset (int): the number of samples generated before, to seed new ones.
+    @param on_sample (callable): called with each kept sample once its mutant is written.
     """
 
-    os.makedirs(self.outputdir, exist_ok=True)
-    return len([f for f in os.listdir(self.outputdir) if os.path.isdir(os.path.join(self.outputdir, f))])
+    auto = self.batch_size == "auto"
+    batch_size = len(samples) if auto else int(self.batch_size)
+    order = {id(sample): offset + o for o, sample in enumerate(samples)}
+    done = 0
+
+    for group in _group_by_pocket(samples, self.pocket_tolerance):
+      start = 0
+
+      while start < len(group):
+        batch_samples = group[start:start + batch_size]
+        first = batch_samples[0]
+
+        # each batch is seeded from the position of its first sample : PocketGen 
+        # draws the noise of a whole batch from the global generator, so a mutant 
+        # is only reproduced by the same seed, batch size and position in the batch
+        seed = self.seed + order[id(first)]
+        seed_all(seed)
+        batch_dir = os.path.join(first["target"]["run_dir"], f".batch_{seed}")
+        if self.in_memory: # outputs are read back from the node-local disk
+          batch_dir = os.path.join(self.scratch, f"flint_{os.getpid()}_batch_{seed}")
+
+        try:
+          with self.tracer.span("generation", profile=True, batch_size=len(batch_samples), seed=seed):
+            batch = self.collate([sample["features"] for sample in batch_samples])
+            batch = {k: v.to(self.device) if isinstance(v, torch.Tensor) else v for k, v in batch.items()}
+
+            # starts the inference for the whole batch at once
+            self.model.generate(batch, target_path=batch_dir)
+        except RuntimeError as e:
+          if not auto or batch_size == 1 or not _is_out_of_memory(e):
+            raise
+          shutil.rmtree(batch_dir, ignore_errors=True)
+          torch.cuda.empty_cache()
+          batch_size = max(1, batch_size // 2)
+
+          if self.verbose == 2:
+            print(f"\tout of memory, batch size lowered to {batch_size}.")
+          continue
+
+        # split the batch outputs into one directory per mutant, PocketGen numbers 
+        # them with a counter of the model, which is not reset between batches
+        stems = _batch_stems(batch_dir)
+        for i, sample in enumerate(batch_samples):
+          stem = stems[i] if i < len(stems) else None
+          if self._keep_sample(batch_dir, i, stem, sample, seed, len(batch_samples)) and on_sample is not None:
+            on_sample(sample)
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        start += len(batch_samples)
+        done += len(batch_samples)
+
+        self._notify("generation", {"run": first["target"]["run_dir"], "done": done, "total": len(samples)})
+
+        if self.verbose > 0:
+          print(f"\tinference done on a batch of {len(batch_samples)} mutants.")
+
+
+  def _keep_sample(self, batch_dir:str, i:int, stem:"str | None", sample:dict, seed:int, batch_size:int) -> bool:
+    """
+    Moves the i-th output of a batch to the next mutant_{b} directory of its 
+    target, unless it duplicates a previous mutant and dedup is "skip".
+    @param batch_dir (str): the directory the batch was generated into.
+    @param i (int): index of the sample inside the batch.
+    @param stem (str | None): the number PocketGen wrote the sample files under, see _batch_stems.
+    @param sample (dict): the sample, whose mutant index is set if kept.
+    @param seed (int): the seed of the batch.
+    @param batch_size (int): the number of samples of the batch.
+    @return (bool): True if the mutant was kept.
+    """
+
+    target = sample["target"]
+    b = target["next"]
+    mutant_dir = os.path.join(target["run_dir"], f"mutant_{b}")
+
+    # in memory, the outputs are read once, before they are moved to the run
+    blocks = sequence = None
+    if self.in_memory:
+      blocks = _read_blocks(os.path.join(batch_dir, f"{stem}_whole.pdb"), os.path.join(batch_dir, f"{stem}.sdf"))
+      sequence = parse_sequence(blocks[0].splitlines()) if blocks else None
+    _split_sample(batch_dir, stem, mutant_dir, b)
+
+    if self.dedup != "off":
+      if self.in_memory:
+        key = _sequence_hash(sequence) if sequence is not None else None
+      else:
+        key = _pocket_hash(os.path.join(mutant_dir, f"{b}_whole.pdb"))
+      if key in target["seen"]:
+        if self.dedup == "skip":
+          shutil.rmtree(mutant_dir)
+          target["journal"].append("generation", id=None, seed=seed, batch_size=batch_size, position=i)
+          return False
+        target["duplicates"][f"mutant_{b}"] = target["seen"][key]
+      elif key is not None:
+        target["seen"][key] = f"mutant_{b}"
+
+    if self.in_memory:
+      sample["blocks"] = blocks
+      target.setdefault("sequences", {})[f"mutant_{b}"] = sequence or {}
+    sample["index"] = b
+    target["next"] += 1
+    target["seeds"].append(seed)
+    target["batches"].append(f"{batch_size}:{i}")
+    target["journal"].append("generation", id=f"mutant_{b}", seed=seed, batch_size=batch_size, position=i,
+      duplicate_of=target["duplicates"].get(f"mutant_{b}"))
+    self.catalog.add_mutant(target["run_dir"], f"mutant_{b}", seed, target["duplicates"].get(f"mutant_{b}"))
+    return True
+
+
+  def _store_sources(self, run_dir:str, sources:"list[str]", number:int) -> None:
+    """
+    Copies the original input files into a run directory, for comparison.
+    @param run_dir (str): the run directory.
+    @param sources (list[str]): the receptor and ligand paths.
+    @param number (int): the number of mutants requested for the run.
+    """
+
+    os.makedirs(os.path.join(run_dir, "original"), exist_ok=True)
+    shutil.copyfile(sources[0], os.path.join(run_dir, "original", "orig_receptor.pdb"))
+    shutil.copyfile(sources[1], os.path.join(run_dir, "original", "orig_ligand.sdf"))
+
+    # write inputs details to a local file
+    with open(os.path.join(run_dir, "inputs.txt"), "w") as file:
+      file.write(f"RECEPTOR: {sources[0]}\nLIGAND: {sources[1]}\nNUMBER: {number}\n")
+
+
+  def _store_seeds(self, run_dir:str, target:dict, generation_time:float) -> None:
+    """
+    Appends the seed, batch size and position in the batch of each mutant 
+    (the three of them reproduce it) to the inputs details of a run, 
+    lists the mutants that duplicate a previous one, and marks the run as 
+    generated in the catalog.
+    @param run_dir (str): the run directory.
+    @param target (dict): the target, as filled by _generate_targets.
+    @param generation_time (float): the generation wall time, in seconds.
+    """
+
+    with open(os.path.join(run_dir, "inputs.txt"), "a") as file:
+      file.write(f"SEEDS: {' '.join(str(seed) for seed in target['seeds'])}\n")
+      file.write(f"BATCHES: {' '.join(target['batches'])}\n")
+
+    if target["duplicates"]:
+      with open(os.path.join(run_dir, "duplicates.tsv"), "w") as file:
+        file.write("ID\tduplicate of\n")
+        file.write("".join(f"{name}\t{of}\n" for name, of in target["duplicates"].items()))
+
+    self.catalog.set_status(run_dir, "generated", generation_time=generation_time)
+
+
+  def _new_run(self, sources:"list[str]", number:int) -> str:
+    """
+    Allocates the next run in the catalog and stores its inputs.
+    @param sources (list[str]): the receptor and ligand paths.
+    @param number (int): the number of mutants requested for the run.
+    @return (str): the path of the new run_{n} folder.
+    """
+
+    run_dir = self.catalog.new_run(sources, number)
+    self._store_sources(run_dir, sources, number)
+    return run_dir
+
+
+  def _notify(self, stage:str, details:dict) -> None:
+    """
+    Sends a progress event to the progress callable, if one is set.
+    @param stage (str): the pipeline stage the event comes from.
+    @param details (dict): JSON-serializable event content.
+    """
+
+    if self.progress is not None:
+      self.progress(stage, details)
 
 
   def _nbatches(self, run_path) -> int:
     """
-    returns the number of inferences stored from now in the output directory
-    @return (int): the number of folders in dir
+    returns the number of mutants of a run, from the catalog or from its 
+    mutant_{b} folders for runs written before the catalog existed
+    @return (int): the number of mutants in dir
     """
 
-    os.makedirs(run_path, exist_ok=True)
-    return len([f for f in os.listdir(run_path) if os.path.isdir(os.path.join(run_path, f))]) - 1
+    count = self.catalog.mutants(run_path)
+    if count is None:
+      count = len([f for f in os.listdir(run_path) 
+        if f.startswith("mutant_") and os.path.isdir(os.path.join(run_path, f))])
+    return count
+
+
+def _batch_stems(batch_dir:str) -> "list[str]":
+  """
+  Lists the numbers PocketGen wrote the samples of a batch under ({n}_whole.pdb, 
+  {n}.sdf, ...). They follow the order of the batch, but may not start at 0, 
+  as PocketGen counts its outputs over the lifetime of the model.
+  @param batch_dir (str): the directory the batch was generated into.
+  @return (list[str]): the numbers, in batch order.
+  """
+
+  if not os.path.isdir(batch_dir):
+    return []
+  stems = {_split_name(name)[0] for name in os.listdir(batch_dir)}
+  return sorted((stem for stem in stems if stem.isdigit()), key=int)
+
+
+def _split_name(name:str) -> "tuple[str, str, str]":
+  # {n}_whole.pdb and {n}.sdf give ("n", "_", "whole.pdb") and ("n", ".", "sdf")
+  return name.partition("_") if "_" in name.split(".")[0] else name.partition(".")
+
+
+def _split_sample(batch_dir:str, stem:"str | None", target_dir:str, b:int) -> None:
+  """
+  Moves the files written by PocketGen for one sample of a batch 
+  ({stem}_whole.pdb, {stem}.sdf, ...) to their own mutant directory, renamed 
+  after the global mutant index b.
+  @param batch_dir (str): the directory the batch was generated into.
+  @param stem (str | None): the number of the sample files, see _batch_stems, None if it wrote none.
+  @param target_dir (str): the mutant_{b} directory.
+  @param b (int): index of the mutant inside the run.
+  """
+
+  os.makedirs(target_dir, exist_ok=True)
+  for name in os.listdir(batch_dir) if stem is not None else []:
+    prefix, sep, rest = _split_name(name)
+    if prefix == stem:
+      shutil.move(os.path.join(batch_dir, name), os.path.join(target_dir, f"{b}{sep}{rest}"))
+
+
+def _pocket_hash(receptor_path:str) -> "str | None":
+  """
+  Hashes the residue sequence of a generated receptor, which only differs 
+  from the original in its pocket.
+  @param receptor_path (str): path to the mutant PDB file.
+  @return (str | None): a sha256 hex digest, None if the file was not generated.
+  """
+
+  if not os.path.isfile(receptor_path):
+    return None
+  return _sequence_hash(get_sequence(receptor_path))
+
+
+def _sequence_hash(sequence:dict) -> str:
+  """
+  Hashes a residue sequence, see _pocket_hash.
+  @param sequence (dict): the sequence, as returned by get_sequence.
+  @return (str): a sha256 hex digest.
+  """
+
+  return hashlib.sha256("".join(sequence.values()).encode()).hexdigest()
+
+
+def _read_blocks(receptor_path:str, ligand_path:str) -> "tuple[str, str] | None":
+  """
+  Reads the contents of a receptor and a ligand file.
+  @param receptor_path (str): path to the PDB file.
+  @param ligand_path (str): path to the SDF file.
+  @return (tuple[str, str] | None): the PDB and SDF contents, None if a file was not generated.
+  """
+
+  if not (os.path.isfile(receptor_path) and os.path.isfile(ligand_path)):
+    return None
+  with open(receptor_path, "r") as receptor, open(ligand_path, "r") as ligand:
+    return receptor.read(), ligand.read()
+
+
+def _read_inputs(run_dir:str) -> "dict[str, str]":
+  """
+  Reads the inputs.txt file of a run.
+  @param run_dir (str): the run directory.
+  @return (dict[str, str]): the value of each KEY: value line.
+  """
+
+  path = os.path.join(run_dir, "inputs.txt")
+  if not os.path.isfile(path):
+    return {}
+  with open(path, "r") as file:
+    return dict(line.rstrip("\n").split(": ", 1) for line in file if ": " in line)
+
+
+def _read_duplicates(run_dir:str) -> "dict[str, str]":
+  """
+  Reads the duplicates.tsv file of a run.
+  @param run_dir (str): the run directory.
+  @return (dict[str, str]): the mutant each duplicate is identical to.
+  """
+
+  path = os.path.join(run_dir, "duplicates.tsv")
+  if not os.path.isfile(path):
+    return {}
+  with open(path, "r") as file:
+    return dict(line.rstrip("\n").split("\t") for line in file.readlines()[1:] if line.strip())
+
+
+def _link_duplicates(names:"list[str]", values:list, duplicates:"dict[str, str]") -> list:
+  """
+  Gives every duplicate the value of the mutant it duplicates.
+  @param names (list[str]): the summary ID of each value.
+  @param values (list): one value per name.
+  @param duplicates (dict[str, str]): the mutant each duplicate is identical to.
+  @return (list): the values, with duplicates filled.
+  """
+
+  index = {name: i for i, name in enumerate(names)}
+  return [values[index[duplicates[name]]] if name in duplicates else value 
+    for name, value in zip(names, values)]
+
+
+def _group_by_pocket(samples:"list[dict]", tolerance:float) -> "list[list[dict]]":
+  """
+  Sorts samples by pocket size and cuts them into groups whose largest pocket 
+  is at most (1 + tolerance) times the smallest one, to limit padding in batches.
+  @param samples (list[dict]): samples holding their features.
+  @param tolerance (float): the relative size difference allowed in a group.
+  @return (list[list[dict]]): the groups, each one sorted by pocket size.
+  """
+
+  size = lambda sample: len(sample["features"]["protein_pos"])
+  groups = []
+  for sample in sorted(samples, key=size): # stable, mutants of a target stay in order
+    if not groups or size(sample) > (1 + tolerance) * size(groups[-1][0]):
+      groups.append([])
+    groups[-1].append(sample)
+  return groups
+
+
+def _is_out_of_memory(error:Exception) -> bool:
+  """
+  Tells whether a runtime error was raised because the device ran out of memory.
+  @param error (Exception): the error raised during inference.
+  @return (bool): True for CUDA and CPU allocation failures.
+  """
 
+  message = str(error)
+  return "out of memory" in message or "can't allocate memory" in message
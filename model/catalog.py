@@ -0,0 +1,238 @@
+import os
+import csv
+import time
+import sqlite3
+import hashlib
+from contextlib import closing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+  id INTEGER PRIMARY KEY,
+  receptor TEXT,
+  ligand TEXT,
+  receptor_hash TEXT,
+  ligand_hash TEXT,
+  number INTEGER,
+  status TEXT NOT NULL,
+  created REAL,
+  generation_time REAL,
+  docking_time REAL
+);
+CREATE TABLE IF NOT EXISTS mutants (
+  run INTEGER NOT NULL REFERENCES runs(id),
+  name TEXT NOT NULL,
+  seed INTEGER,
+  duplicate_of TEXT,
+  delta_G REAL,
+  Kd REAL,
+  triage_delta_G REAL,
+  mutations TEXT,
+  PRIMARY KEY (run, name)
+);
+CREATE INDEX IF NOT EXISTS mutants_delta_G ON mutants(delta_G);
+CREATE INDEX IF NOT EXISTS runs_status ON runs(status);
+"""
+
+class Catalog:
+  def __init__(self, outputdir:str):
+    """
+    SQLite index of the runs of an output directory (catalog.sqlite) : their
+    inputs, mutants, docking energies and timings. Runs are numbered by the
+    catalog rather than by counting folders, and a run goes through the
+    "generating", "generated" and "done" statuses. An output directory
+    written before the catalog existed is imported on first use.
+    @param outputdir (str): the output directory.
+    """
+
+    self.outputdir = outputdir
+    self.path = os.path.join(outputdir, "catalog.sqlite")
+    os.makedirs(outputdir, exist_ok=True)
+
+    with closing(self._connect()) as db, db:
+      db.executescript(SCHEMA)
+      if db.execute("SELECT COUNT(*) FROM runs").fetchone()[0] == 0:
+        self._import(db)
+
+
+  def new_run(self, sources:"list[str]", number:int) -> str:
+    """
+    Allocates the next run and creates its directory. The allocation holds
+    the database write lock, so that concurrent processes never share a run.
+    @param sources (list[str]): the receptor and ligand paths.
+    @param number (int): the number of mutants requested.
+    @return (str): the path of the new run_{n} folder.
+    """
+
+    hashes = [_file_hash(path) for path in sources]
+    with closing(self._connect()) as db:
+      db.execute("BEGIN IMMEDIATE")
+      run = db.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM runs").fetchone()[0]
+
+      # folders left by other tools keep their name
+      while os.path.exists(self.run_dir(run)):
+        run += 1
+
+      db.execute("INSERT INTO runs (id, receptor, ligand, receptor_hash, ligand_hash, number, status, created) "
+        "VALUES (?, ?, ?, ?, ?, ?, 'generating', ?)", (run, *sources, *hashes, number, time.time()))
+      os.makedirs(self.run_dir(run))
+      db.commit()
+
+    return self.run_dir(run)
+
+
+  def run_dir(self, run:int) -> str:
+    return os.path.join(self.outputdir, f"run_{run}")
+
+
+  def runs(self, status:"str | None"=None) -> "list[str]":
+    """
+    Lists the run directories, optionally restricted to a status.
+    @param status (str | None): "generating", "generated" or "done".
+    @return (list[str]): the run directories, in allocation order.
+    """
+
+    with closing(self._connect()) as db:
+      if status is None:
+        rows = db.execute("SELECT id FROM runs ORDER BY id").fetchall()
+      else:
+        rows = db.execute("SELECT id FROM runs WHERE status = ? ORDER BY id", (status,)).fetchall()
+    return [self.run_dir(run) for run, in rows]
+
+
+  def add_mutant(self, run_dir:str, name:str, seed:int, duplicate_of:"str | None"=None) -> None:
+    """
+    Records a generated mutant.
+    @param run_dir (str): the run directory.
+    @param name (str): the mutant ID (mutant_{b}).
+    @param seed (int): the seed of the batch it was generated in.
+    @param duplicate_of (str | None): the mutant it is identical to.
+    """
+
+    with closing(self._connect()) as db, db:
+      db.execute("INSERT OR REPLACE INTO mutants (run, name, seed, duplicate_of) VALUES (?, ?, ?, ?)",
+        (_run_id(run_dir), name, seed, duplicate_of))
+
+
+  def mutants(self, run_dir:str) -> "int | None":
+    """
+    Returns the number of mutants recorded for a run.
+    @param run_dir (str): the run directory.
+    @return (int | None): the number of mutants, None if none was recorded.
+    """
+
+    with closing(self._connect()) as db:
+      count = db.execute("SELECT COUNT(*) FROM mutants WHERE run = ? AND seed IS NOT NULL", 
+        (_run_id(run_dir),)).fetchone()[0]
+    return count or None
+
+
+  def set_status(self, run_dir:str, status:str, **timings) -> None:
+    """
+    Moves a run to its next status.
+    @param run_dir (str): the run directory.
+    @param status (str): "generating", "generated" or "done".
+    @param timings: generation_time and / or docking_time, in seconds.
+    """
+
+    columns = "".join(f", {column} = ?" for column in timings)
+    with closing(self._connect()) as db, db:
+      db.execute(f"UPDATE runs SET status = ?{columns} WHERE id = ?",
+        (status, *timings.values(), _run_id(run_dir)))
+
+
+  def set_scores(self, run_dir:str, rows:"list[tuple]") -> None:
+    """
+    Records the docking results of a run.
+    @param run_dir (str): the run directory.
+    @param rows (list[tuple]): (name, delta_G, Kd, triage_delta_G, mutations) per job, None when missing.
+    """
+
+    run = _run_id(run_dir)
+    with closing(self._connect()) as db, db:
+      db.executemany("INSERT INTO mutants (run, name, delta_G, Kd, triage_delta_G, mutations) VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (run, name) DO UPDATE SET delta_G = excluded.delta_G, Kd = excluded.Kd, "
+        "triage_delta_G = excluded.triage_delta_G, mutations = excluded.mutations",
+        [(run, *row) for row in rows])
+
+
+  def top(self, n:int=20) -> "list[dict]":
+    """
+    Returns the best docked mutants across all runs.
+    @param n (int): the number of mutants.
+    @return (list[dict]): run, ID, delta_G, Kd, mutations and receptor of each mutant, lowest delta_G first.
+    """
+
+    with closing(self._connect()) as db:
+      db.row_factory = sqlite3.Row
+      rows = db.execute("SELECT 'run_' || runs.id AS run, name AS ID, delta_G, Kd, mutations, receptor "
+        "FROM mutants JOIN runs ON runs.id = mutants.run "
+        "WHERE delta_G IS NOT NULL AND name != 'original' ORDER BY delta_G LIMIT ?", (n,)).fetchall()
+    return [dict(row) for row in rows]
+
+
+  def summary(self) -> "list[dict]":
+    """
+    Returns one row per run, with its inputs, status, timings and best mutant.
+    @return (list[dict]): the runs, in allocation order.
+    """
+
+    with closing(self._connect()) as db:
+      db.row_factory = sqlite3.Row
+      rows = db.execute("SELECT 'run_' || id AS run, receptor, ligand, number, status, generation_time, docking_time, "
+        "(SELECT MIN(delta_G) FROM mutants WHERE run = runs.id AND name != 'original') AS best_delta_G "
+        "FROM runs ORDER BY id").fetchall()
+    return [dict(row) for row in rows]
+
+
+  def _connect(self) -> sqlite3.Connection:
+    # waits for the lock held by another process instead of failing
+    return sqlite3.connect(self.path, timeout=60)
+
+
+  def _import(self, db:sqlite3.Connection) -> None:
+    """
+    Registers the run folders written before the catalog existed, with the
+    scores of their summary file.
+    @param db (sqlite3.Connection): the open catalog.
+    """
+
+    for name in os.listdir(self.outputdir):
+      run_dir = os.path.join(self.outputdir, name)
+      if not (name.startswith("run_") and name[4:].isdigit() and os.path.isdir(run_dir)):
+        continue
+
+      inputs = {}
+      if os.path.isfile(os.path.join(run_dir, "inputs.txt")):
+        with open(os.path.join(run_dir, "inputs.txt"), "r") as file:
+          inputs = dict(line.rstrip("\n").split(": ", 1) for line in file if ": " in line)
+
+      status = "generated" if "SEEDS" in inputs or "NUMBER" not in inputs else "generating"
+      summary_path = os.path.join(run_dir, "summary.tsv")
+      rows = []
+      if os.path.isfile(summary_path):
+        status = "done"
+        with open(summary_path, "r") as file:
+          for row in csv.DictReader(file, delimiter="\t"):
+            rows.append((int(name[4:]), row["ID"], _float(row.get("delta_G")), _float(row.get("Kd")),
+              _float(row.get("triage_delta_G")), row.get("sequence of mutations")))
+
+      db.execute("INSERT OR IGNORE INTO runs (id, receptor, ligand, number, status) VALUES (?, ?, ?, ?, ?)",
+        (int(name[4:]), inputs.get("RECEPTOR"), inputs.get("LIGAND"), inputs.get("NUMBER"), status))
+      db.executemany("INSERT OR REPLACE INTO mutants (run, name, delta_G, Kd, triage_delta_G, mutations) "
+        "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+
+def _run_id(run_dir:str) -> int:
+  return int(os.path.basename(os.path.normpath(run_dir))[4:])
+
+
+def _float(value:"str | None") -> "float | None":
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return None
+
+
+def _file_hash(path:str) -> str:
+  with open(path, "rb") as file:
+    return hashlib.sha256(file.read()).hexdigest()
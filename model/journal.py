@@ -0,0 +1,82 @@
+import os
+import json
+import threading
+
+class Journal:
+  def __init__(self, run_dir:str):
+    """
+    Append-only progress log of a run (progress.jsonl). Every generated mutant
+    and every docking result is written and synced to disk as soon as it is
+    known, so that an interrupted run can be resumed where it stopped.
+    @param run_dir (str): the run directory.
+    """
+
+    self.path = os.path.join(run_dir, "progress.jsonl")
+    self.lock = threading.Lock()
+
+
+  def append(self, stage:str, **entry) -> None:
+    """
+    Writes one entry and flushes it to disk.
+    @param stage (str): "generation", "triage", "dock" or "failed".
+    @param entry: JSON-serializable content of the entry.
+    """
+
+    line = json.dumps({"stage": stage, **entry}) + "\n"
+    with self.lock, open(self.path, "a") as file:
+      file.write(line)
+      file.flush()
+      os.fsync(file.fileno())
+
+
+  def entries(self, stage:str) -> "list[dict]":
+    """
+    Reads the entries of a stage, ignoring a line cut by a crash.
+    @param stage (str): "generation", "triage", "dock" or "failed".
+    @return (list[dict]): the entries, in the order they were written.
+    """
+
+    if not os.path.isfile(self.path):
+      return []
+
+    entries = []
+    with open(self.path, "r") as file:
+      for line in file:
+        try:
+          entry = json.loads(line)
+        except json.JSONDecodeError:
+          continue
+        if entry.get("stage") == stage:
+          entries.append(entry)
+    return entries
+
+
+  def scores(self, stage:str) -> "dict[str, tuple[float, float]]":
+    """
+    Returns the docking results of a stage, by summary ID.
+    @param stage (str): "triage" or "dock".
+    @return (dict[str, tuple[float, float]]): the (deltaG, Kd) of each docked ID.
+    """
+
+    return {entry["id"]: (entry["delta_G"], entry["Kd"]) for entry in self.entries(stage)}
+
+
+  def energies(self, stage:str) -> "dict[str, list[float]]":
+    """
+    Returns the pose energies of the docking results of a stage, by summary ID.
+    @param stage (str): "triage" or "dock".
+    @return (dict[str, list[float]]): the energies of each docked ID, if they were journaled.
+    """
+
+    return {entry["id"]: entry["energies"] for entry in self.entries(stage) if "energies" in entry}
+
+
+  def failures(self, stage:str) -> "set[str]":
+    """
+    Returns the IDs whose docking failed in a stage and did not succeed since.
+    Failed dockings have no result entry, so that a resumed run docks them again.
+    @param stage (str): "triage" or "dock".
+    @return (set[str]): the failed IDs.
+    """
+
+    return {entry["id"] for entry in self.entries("failed") if entry.get("of") == stage} - set(self.scores(stage))
@@ -0,0 +1,59 @@
+import os
+import csv
+import json
+
+def read_manifest(manifest_path:str, number:int=8) -> "list[tuple[str, str, int]]":
+  """
+  Reads the targets of a multi-target run from a CSV or JSONL file, with one
+  receptor / ligand / number row per target. Relative paths are resolved
+  against the manifest folder.
+  @param manifest_path (str): path to the .csv or .jsonl manifest.
+  @param number (int): the number of mutants of rows that do not set it.
+  @return (list[tuple[str, str, int]]): (receptor_path, ligand_path, number) triples.
+  """
+
+  with open(manifest_path, "r") as file:
+    if manifest_path.endswith(".jsonl"):
+      rows = [json.loads(line) for line in file if line.strip()]
+    else:
+      rows = list(csv.DictReader(file))
+
+  root = os.path.dirname(os.path.abspath(manifest_path))
+  targets = []
+  for i, row in enumerate(rows):
+    if not row.get("receptor") or not row.get("ligand"):
+      raise ValueError(f"manifest row {i} needs a receptor and a ligand")
+    targets.append((
+      os.path.join(root, row["receptor"]),
+      os.path.join(root, row["ligand"]),
+      int(row.get("number") or number)
+    ))
+
+  return targets
+
+
+def write_summary(
+  summary_path:str,
+  targets:"list[tuple[str, str, int]]",
+  runs:"list[str]") -> None:
+
+  """
+  Concatenates the summary of each target run into a single TSV file,
+  prefixed with the target inputs and its run directory.
+  @param summary_path (str): path to the combined summary.
+  @param targets (list[tuple[str, str, int]]): the manifest targets.
+  @param runs (list[str]): the run directory of each target.
+  """
+
+  header, lines = None, []
+  for (receptor_path, ligand_path, _), run_dir in zip(targets, runs):
+    with open(os.path.join(run_dir, "summary.tsv"), "r") as file:
+      run_header, *rows = file.read().splitlines()
+    header = header or run_header
+
+    for row in rows:
+      lines.append(f"{receptor_path}\t{ligand_path}\t{os.path.basename(run_dir)}\t{row}")
+
+  with open(summary_path, "w") as file:
+    file.write(f"receptor\tligand\trun\t{header}\n")
+    file.write("".join(line + "\n" for line in lines))
@@ -1,52 +1,251 @@
+import os
+import json
+import hashlib
+import numpy as np
 import torch
 from .featurize import densify, featurize
 from PocketGen.utils.protein_ligand import PDBProtein, parse_sdf_file
 from PocketGen.utils.data import torchify_dict
+from eval.mutations import AMINO_ACIDS
+from eval.cache import evict
+
+def interaction(
+  receptor_path:str, 
+  ligand_path:str, 
+  radius:float=10, 
+  edit_radius:float=3.5,
+  cachedir:"str | None"=None,
+  max_entries:"int | None"=None) -> torch.Tensor:
 
-def interaction(receptor_path:str, ligand_path:str) -> torch.Tensor:
   """
   Convert PDB and SDF files into a set of protein-ligand interaction features.
   @param ligand_path (str): path to the ligand SDF file.
   @param receptor_path (str): path to the receptor PDB file.
+  @param radius (float): radius around the ligand defining the pocket (angstrom).
+  @param edit_radius (float): radius around the ligand defining the edited residues (angstrom).
+  @param cachedir (str | None): folder where features are persisted, None disables it.
+  @param max_entries (int | None): the number of cached inputs kept, least recently used first out, None keeps them all.
   @return (torch.Tensor): a data-dense feature tensor representing the interaction.
   """
 
+  # a hit is memory-mapped back instead of parsing the molecules again
+  if cachedir is not None:
+    cache_path = os.path.join(cachedir, f"{_features_key(receptor_path, ligand_path, radius, edit_radius)}.pt")
+    if os.path.isfile(cache_path):
+      data = torch.load(cache_path, mmap=True, weights_only=False)
+      os.utime(cache_path) # the modification time is the LRU clock
+      data.update(_metadata(receptor_path, ligand_path))
+      return data
+
+  data, _ = interaction_frame(receptor_path, ligand_path, radius, edit_radius)
+
+  # write then rename, so that concurrent jobs never load half a file
+  if cachedir is not None:
+    os.makedirs(cachedir, exist_ok=True)
+    torch.save(data, cache_path + f".{os.getpid()}.tmp")
+    os.replace(cache_path + f".{os.getpid()}.tmp", cache_path)
+    if max_entries is not None:
+      evict(cachedir, max_entries, ".pt")
+
+  return data
+
+
+def interaction_frame(
+  receptor_path:str, 
+  ligand_path:str, 
+  radius:float=10, 
+  edit_radius:float=3.5) -> "tuple[torch.Tensor, dict]":
+
+  """
+  Convert PDB and SDF files into interaction features, see interaction(), 
+  along with the frame update_interaction() needs to featurize mutants of 
+  the receptor without parsing them entirely.
+  @param receptor_path (str): path to the receptor PDB file.
+  @param ligand_path (str): path to the ligand SDF file.
+  @param radius (float): radius around the ligand defining the pocket (angstrom).
+  @param edit_radius (float): radius around the ligand defining the edited residues (angstrom).
+  @return (tuple[torch.Tensor, dict]): the dense features and the frame of the receptor.
+  """
+
   # read and parses the mol (pdb / sdf) files
   pdb_block = open(receptor_path, 'r').read()
   protein = PDBProtein(pdb_block)
   ligand_dict = parse_sdf_file(ligand_path, feat=False)
 
   # select only the residues inside a radius around the ligand
-  r10_index, r10_residues = protein.query_residues_ligand(ligand_dict, radius=10, selected_residue=None, return_mask=False)
-  full_seq_index, full_seq_residues = protein.query_residues_ligand(ligand_dict, radius=3.5, selected_residue=r10_residues, return_mask=False)
+  r10_index, r10_residues = protein.query_residues_ligand(ligand_dict, radius=radius, selected_residue=None, return_mask=False)
+  full_seq_index, full_seq_residues = protein.query_residues_ligand(ligand_dict, radius=edit_radius, selected_residue=r10_residues, return_mask=False)
 
   # defines pocket from the (r < 10) residues
-  pocket = PDBProtein(protein.residues_to_pdb_block(r10_residues))
+  pocket_block = protein.residues_to_pdb_block(r10_residues)
+  seq = ''.join(protein.to_dict_residue()['seq'])
+  data = _pocket_features(pocket_block, ligand_dict, seq, full_seq_index, r10_index)
+
+  # add metadata
+  data.update(_metadata(receptor_path, ligand_path))
+
+  # the pocket residues are the ones a mutant may change
+  frame = {
+    "receptor_path": receptor_path,
+    "ligand_path": ligand_path,
+    "radius": radius,
+    "edit_radius": edit_radius,
+    "ligand_dict": ligand_dict,
+    "residues": _residue_lines(pdb_block.splitlines(keepends=True)),
+    "pocket": list(_residue_lines(pocket_block.splitlines(keepends=True))),
+    "r10_index": sorted(r10_index),
+    "seq": seq
+  }
+
+  # data-dense features tensor
+  return densify(data), frame
+
+
+def update_interaction(frame:dict, receptor_path:str) -> "tuple[torch.Tensor, dict]":
+  """
+  Featurizes a mutant of the receptor of a frame (see interaction_frame) : 
+  the residues outside of the pocket are compared with the frame instead of 
+  being parsed, the whole-protein radius queries and the ligand are reused, 
+  and only the pocket is built again. The mutant is featurized entirely if it 
+  changed residues outside of the pocket, or moved one out of it.
+  @param frame (dict): the frame of the receptor the mutant was generated from.
+  @param receptor_path (str): path to the mutant PDB file.
+  @return (tuple[torch.Tensor, dict]): the dense features and the frame of the mutant.
+  """
+
+  with open(receptor_path, 'r') as file:
+    residues = _residue_lines(file)
+
+  # only residues whose atoms moved are looked at again
+  changed = {key for key, lines in residues.items()
+    if [line[12:54] for line in lines] != [line[12:54] for line in frame["residues"].get(key, [])]}
+
+  pocket = set(frame["pocket"])
+  if (list(residues) != list(frame["residues"]) or len(residues) != len(frame["seq"]) 
+    or any(key not in pocket or residues[key][0][17:20] not in AMINO_ACIDS for key in changed)
+    or not all(_within(residues[key], frame["ligand_dict"]["pos"], frame["radius"]) for key in changed)):
+    return interaction_frame(receptor_path, frame["ligand_path"], frame["radius"], frame["edit_radius"])
+
+  # residues keep their place in the sequence
+  seq = list(frame["seq"])
+  for i, key in enumerate(residues):
+    if key in changed:
+      seq[i] = AMINO_ACIDS[residues[key][0][17:20]]
+  seq = ''.join(seq)
+
+  # unchanged residues keep their distance to the ligand, only the pocket is queried
+  pocket_block = "".join(line for key in frame["pocket"] for line in residues[key]) + "END\n"
+  data = _pocket_features(pocket_block, frame["ligand_dict"], seq, None, frame["r10_index"], frame["edit_radius"])
+  data.update(_metadata(receptor_path, frame["ligand_path"]))
+
+  return densify(data), dict(frame, receptor_path=receptor_path, residues=residues, seq=seq)
+
+
+def _pocket_features(
+  pocket_block:str, 
+  ligand_dict:dict, 
+  seq:str, 
+  full_seq_index:"list[int] | None", 
+  r10_index:"list[int]",
+  edit_radius:float=3.5) -> dict:
+
+  """
+  Builds the feature dict of a pocket, see featurize.
+  @param pocket_block (str): the PDB lines of the pocket residues, in sequence order.
+  @param ligand_dict (dict): the parsed ligand, see parse_sdf_file.
+  @param seq (str): the full amino-acid sequence.
+  @param full_seq_index (list[int] | None): the edited residues of the whole sequence, 
+  queried in the pocket within edit_radius if None.
+  @param r10_index (list[int]): the pocket residues of the whole sequence.
+  @param edit_radius (float): radius around the ligand defining the edited residues (angstrom).
+  @return (dict): a feature dictionnary, see featurize.
+  """
+
+  pocket = PDBProtein(pocket_block)
   pocket_dict = pocket.to_dict_atom()
   residue_dict = pocket.to_dict_residue()
 
   # defines the scope of protein_edit_residue (sould be of type torch.Tensor[bool])
   _, residue_dict['protein_edit_residue'] = pocket.query_residues_ligand(ligand_dict)
 
-  full_seq_index.sort()
-  r10_index.sort()
+  # the edited residues are pocket residues, the pocket is enough to find them
+  r10_index = sorted(r10_index)
+  if full_seq_index is None:
+    pocket_index, _ = pocket.query_residues_ligand(ligand_dict, radius=edit_radius, selected_residue=None, return_mask=False)
+    full_seq_index = [r10_index[i] for i in pocket_index]
+  full_seq_index = sorted(full_seq_index)
 
   # transforms data into features
-  data = featurize(
+  return featurize(
     protein_dict=torchify_dict(pocket_dict),
     ligand_dict=torchify_dict(ligand_dict),
     residue_dict=torchify_dict(residue_dict),
-    seq=''.join(protein.to_dict_residue()['seq']),
+    seq=seq,
     full_seq_index=torch.tensor(full_seq_index),
     r10_index=torch.tensor(r10_index)
   )
 
-  # add metadata
-  data.update({
+
+def _within(lines:"list[str]", ligand_pos:np.ndarray, radius:float) -> bool:
+  """
+  Tells if a residue is in the pocket, by the distance of its closest atom to
+  the ligand, as PDBProtein.query_residues_ligand selects it.
+  @param lines (list[str]): the atom lines of the residue.
+  @param ligand_pos (np.ndarray): the (atoms, 3) ligand coordinates.
+  @param radius (float): radius around the ligand defining the pocket (angstrom).
+  @return (bool): True if an atom of the residue is closer than radius to the ligand.
+  """
+
+  pos = np.array([[float(line[30:38]), float(line[38:46]), float(line[46:54])] for line in lines])
+  distances = np.linalg.norm(pos[:, None, :] - np.asarray(ligand_pos)[None, :, :], axis=-1)
+  return bool(distances.min() < radius)
+
+
+def _residue_lines(pdb_lines) -> "dict[str, list[str]]":
+  """
+  Groups the atom lines of the first model of a PDB file by residue.
+  @param pdb_lines: an iterable of PDB lines, with their line endings.
+  @return (dict[str, list[str]]): the lines of each residue, keyed by chain, 
+  number and insertion code, in file order.
+  """
+
+  residues = {}
+  for line in pdb_lines:
+    if line.startswith("ENDMDL"):
+      break
+    if line.startswith("ATOM"):
+      residues.setdefault(line[21:27], []).append(line if line.endswith("\n") else line + "\n")
+  return residues
+
+
+def _metadata(receptor_path:str, ligand_path:str) -> dict:
+  """
+  Builds the file metadata of a feature dict, which is not part of the cache key.
+  @param receptor_path (str): path to the receptor PDB file.
+  @param ligand_path (str): path to the ligand SDF file.
+  @return (dict): the filename entries of the features.
+  """
+
+  return {
     'protein_filename': receptor_path,
     'ligand_filename': ligand_path,
     'whole_protein_name': receptor_path 
-  })
+  }
+
+
+def _features_key(receptor_path:str, ligand_path:str, radius:float, edit_radius:float) -> str:
+  """
+  Builds the cache address of the features of a receptor-ligand pair.
+  @param receptor_path (str): path to the receptor PDB file.
+  @param ligand_path (str): path to the ligand SDF file.
+  @param radius (float): radius around the ligand defining the pocket (angstrom).
+  @param edit_radius (float): radius around the ligand defining the edited residues (angstrom).
+  @return (str): a sha256 hex digest.
+  """
 
-  # return data-dense features tensor
-  return densify(data)
\ No newline at end of file
+  digest = hashlib.sha256()
+  for path in (receptor_path, ligand_path):
+    with open(path, "rb") as file:
+      digest.update(hashlib.sha256(file.read()).digest())
+  digest.update(json.dumps([float(radius), float(edit_radius)]).encode())
+  return digest.hexdigest()
@@ -0,0 +1,440 @@
+import os
+import time
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+
+from eval.docking import docking
+from eval.prepare import prepare, prepare_string
+from eval.window import compute_box, compute_box_from_blocks, truncate_to_box, write_pocket
+from eval.cache import DockingCache
+from eval.affinity import pad, score as pose_score
+from .tracing import current
+from .workqueue import WorkQueue
+
+def dock(
+  receptor_path:str,
+  ligand_path:str,
+  cpu:int=0,
+  seed:int=0,
+  cache:"DockingCache | None"=None,
+  n_dockings:int=64,
+  n_poses:int=32,
+  box:"dict | None"=None,
+  mode:str="dock",
+  pocket_radius:"float | None"=None,
+  raise_errors:bool=False,
+  verbose:int=1) -> "tuple[float, float, list[float]] | None":
+
+  """
+  Docks a ligand onto a receptor inside a box computed around the ligand.
+  This function is module-level so that it can be sent to pool workers.
+  @param receptor_path (str): path to the receptor PDB file.
+  @param ligand_path (str): path to the ligand SDF file.
+  @param cpu (int): number of CPUs given to Vina (0 uses all of them).
+  @param seed (int): the vina random seed.
+  @param cache (DockingCache | None): where previous docking results are looked up.
+  @param n_dockings (int): number of docking simulations.
+  @param n_poses (int): number of poses kept.
+  @param box (dict | None): the docking window, computed around the ligand if None.
+  @param mode (str): "dock" for a full docking, "optimize" for a cheap minimization score.
+  @param pocket_radius (float | None): if set, the receptor is truncated to the residues within this distance of the box.
+  @param raise_errors (bool): if True, a failed docking raises instead of returning None.
+  @param verbose (int): 0 for quiet, 1 for necessary information and 2 for debug.
+  @return (tuple[float, float, list[float]] | None): the mean deltaG and the mean Kd of the poses, and their energies, None if the docking failed.
+  """
+
+  # in a docking worker, spans go to the log of the parent process
+  tracer = current()
+  with tracer.span("dock", profile=True, receptor=receptor_path, mode=mode) as attrs:
+
+    # compute the docking window around ligand
+    docking_box = box
+    if docking_box is None:
+      with tracer.span("compute_box"):
+        docking_box = compute_box(receptor_path, ligand_path)
+
+    try:
+      # vina maps only depend on the atoms around the box
+      if pocket_radius is not None:
+        with tracer.span("truncate"):
+          receptor_path = write_pocket(receptor_path, docking_box, pocket_radius)
+
+      with tracer.span("prepare"):
+        receptor_file, ligand_file = prepare(receptor_path), prepare(ligand_path)
+
+      key = None
+      if cache is not None:
+        key = cache.key(receptor_file, ligand_file, docking_box["center"],
+          docking_box["size"], n_dockings, n_poses, seed, mode)
+
+      energies = _energies(tracer, attrs, cache, key, docking_box, receptor_file=receptor_file, ligand_file=ligand_file, 
+        n_dockings=n_dockings, n_poses=n_poses, cpu=cpu, seed=seed, mode=mode, verbosity=verbose)
+    except Exception as e:
+      if raise_errors:
+        raise
+      print(f"\t\terror simulating docking: {e}")
+      return None
+
+    return _score(energies)
+
+
+def dock_blocks(
+  receptor_block:str,
+  ligand_block:str,
+  cpu:int=0,
+  seed:int=0,
+  cache:"DockingCache | None"=None,
+  n_dockings:int=64,
+  n_poses:int=32,
+  mode:str="dock",
+  scratch:"str | None"=None,
+  pocket_radius:"float | None"=None,
+  raise_errors:bool=False,
+  verbose:int=1) -> "tuple[float, float, list[float]] | None":
+
+  """
+  Docks a ligand onto a receptor from the contents of their PDB and SDF files : 
+  the box, the PDBQT conversion and the ligand given to Vina stay in memory, 
+  only the prepared receptor is written, to the node-local scratch directory, 
+  as Vina reads receptors from files.
+  @param receptor_block (str): the content of the receptor PDB file.
+  @param ligand_block (str): the content of the ligand SDF file.
+  @param scratch (str | None): the node-local directory, the system temporary one by default.
+  @return (tuple[float, float, list[float]] | None): the mean deltaG and the mean Kd of the poses, and their energies, None if the docking failed.
+  See dock() for the other parameters.
+  """
+
+  tracer = current()
+  with tracer.span("dock", profile=True, mode=mode, in_memory=True) as attrs:
+    try:
+      with tracer.span("compute_box"):
+        docking_box = compute_box_from_blocks(receptor_block, ligand_block)
+
+      if pocket_radius is not None:
+        with tracer.span("truncate"):
+          receptor_block = "".join(truncate_to_box(receptor_block.splitlines(), docking_box, pocket_radius))
+
+      with tracer.span("prepare"):
+        receptor_pdbqt, ligand_pdbqt = prepare_string(receptor_block, "pdb"), prepare_string(ligand_block, "sdf")
+
+      key = None
+      if cache is not None:
+        key = cache.content_key(receptor_pdbqt, ligand_pdbqt, docking_box["center"],
+          docking_box["size"], n_dockings, n_poses, seed, mode)
+
+      with tempfile.NamedTemporaryFile("w", suffix=".pdbqt", dir=scratch) as receptor_file:
+        receptor_file.write(receptor_pdbqt)
+        receptor_file.flush()
+        energies = _energies(tracer, attrs, cache, key, docking_box, receptor_file=receptor_file.name, ligand_file=None, 
+          ligand_string=ligand_pdbqt, n_dockings=n_dockings, n_poses=n_poses, cpu=cpu, seed=seed, mode=mode, verbosity=verbose)
+    except Exception as e:
+      if raise_errors:
+        raise
+      print(f"\t\terror simulating docking: {e}")
+      return None
+
+    return _score(energies)
+
+
+def _score(energies:"list[float]") -> "tuple[float, float, list[float]]":
+  """
+  Scores the poses of a docking by their mean deltaG and mean Kd, keeping their 
+  energies for the other statistics of eval.affinity.
+  @param energies (list[float]): the energies of the poses.
+  @return (tuple[float, float, list[float]]): the mean deltaG and the mean Kd of the poses, and their energies.
+  """
+
+  energies = [float(energy) for energy in energies]
+  delta_G, Kd = pose_score(pad([energies]))
+  return float(delta_G[0]), float(Kd[0]), energies
+
+
+def _energies(tracer, attrs:dict, cache:"DockingCache | None", key:"str | None", box:dict, **kwargs) -> "list[float]":
+  """
+  Looks a docking up in the cache, or runs it and stores it.
+  @param tracer (Tracer): where the vina stages are recorded.
+  @param attrs (dict): the attributes of the dock span, told whether the cache was hit.
+  @param cache (DockingCache | None): where previous docking results are looked up.
+  @param key (str | None): the cache address of the docking.
+  @param box (dict): the docking window.
+  @param kwargs: the other arguments of eval.docking.docking.
+  @return (list[float]): the energies of the poses.
+  """
+
+  # identical prepared files docked with identical parameters give identical energies
+  energies = cache.get(key) if cache is not None else None
+  attrs["cached"] = energies is not None
+  if energies is not None:
+    if kwargs["verbosity"] == 2:
+      print("\t\tdocking found in cache.")
+    return energies
+
+  timings = {}
+  start = time.time()
+  energies = docking(center=box["center"], box_size=box["size"], timings=timings, **kwargs)
+
+  # vina stages are timed inside docking, one after the other
+  for stage in ("vina_maps", "vina_dock"):
+    if stage in timings:
+      tracer.add(stage, start, timings[stage])
+      start += timings[stage]
+
+  if cache is not None:
+    cache.put(key, energies)
+  return energies
+
+
+def dock_all(
+  jobs:"list[tuple[str, str]]",
+  workers:int=1,
+  cpu:int=0,
+  seed:int=0,
+  cache:"DockingCache | None"=None,
+  boxes:"list[dict] | None"=None,
+  n_dockings:int=64,
+  mode:str="dock",
+  pocket_radius:"float | None"=None,
+  callback=None,
+  pool:"ProcessPoolExecutor | None"=None,
+  verbose:int=1) -> "list[tuple[float, float, list[float]] | None]":
+
+  """
+  Docks a list of receptor-ligand pairs, spreading them over a process pool.
+  @param jobs (list[tuple[str, str]]): (receptor_path, ligand_path) pairs.
+  @param workers (int): number of docking processes (1 docks in this process).
+  @param cpu (int): number of CPUs given to Vina in each worker (0 shares them evenly).
+  @param seed (int): the vina random seed.
+  @param cache (DockingCache | None): where previous docking results are looked up.
+  @param boxes (list[dict] | None): the docking window of each job, see compute_boxes.
+  @param n_dockings (int): number of docking simulations.
+  @param mode (str): "dock" for a full docking, "optimize" for a cheap minimization score.
+  @param pocket_radius (float | None): if set, receptors are truncated to the residues within this distance of their box.
+  @param callback (callable): called with (index, score) each time a job is done.
+  @param pool (ProcessPoolExecutor | None): the docking processes, see docking_pool, a pool of workers is started if None.
+  @param verbose (int): 0 for quiet, 1 for necessary information and 2 for debug.
+  @return (list[tuple[float, float, list[float]] | None]): the (deltaG, Kd, pose energies) of each job, in the jobs order, None if its docking failed.
+  """
+
+  workers = max(1, min(workers, len(jobs)))
+  cpu = cpu or max(1, multiprocessing.cpu_count() // workers)
+
+  callback = callback or (lambda i, score: None)
+  boxes = boxes or [None] * len(jobs)
+
+  if workers == 1:
+    scores = []
+    for i, ((receptor, ligand), box) in enumerate(zip(jobs, boxes)):
+      scores.append(dock(receptor, ligand, cpu, seed, cache, n_dockings, box=box, mode=mode, 
+        pocket_radius=pocket_radius, verbose=verbose))
+      callback(i, scores[-1])
+    return scores
+
+  if pool is None:
+    with docking_pool(workers) as pool:
+      return dock_all(jobs, workers, cpu, seed, cache, boxes, n_dockings, mode, pocket_radius, callback, pool, verbose)
+
+  futures = {pool.submit(dock, receptor, ligand, cpu, seed, cache, n_dockings, box=box, mode=mode, 
+    pocket_radius=pocket_radius, verbose=verbose): i 
+    for i, ((receptor, ligand), box) in enumerate(zip(jobs, boxes))}
+  for future in as_completed(futures):
+    callback(futures[future], future.result())
+  return [future.result() for future in futures]
+
+
+def docking_pool(workers:int) -> ProcessPoolExecutor:
+  """
+  Starts the docking processes of dock_all, which several calls can share. 
+  Processes are spawned, so that they do not inherit the torch / CUDA state 
+  of the parent, and only import the docking modules.
+  @param workers (int): number of docking processes.
+  @return (ProcessPoolExecutor): the pool, to be shut down by the caller.
+  """
+
+  return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def dock_queued(
+  jobs:"list[tuple[str, str]]",
+  work_queue:"WorkQueue",
+  seed:int=0,
+  boxes:"list[dict] | None"=None,
+  n_dockings:int=64,
+  mode:str="dock",
+  pocket_radius:"float | None"=None,
+  callback=None,
+  poll:float=1.0,
+  verbose:int=1) -> "list[tuple[float, float, list[float]] | None]":
+
+  """
+  Docks a list of receptor-ligand pairs through a work queue, whose tasks are
+  run by `main.py --worker` processes, possibly on other nodes.
+  @param jobs (list[tuple[str, str]]): (receptor_path, ligand_path) pairs, on a filesystem the workers share.
+  @param work_queue (WorkQueue): the queue the jobs are submitted to.
+  @param seed (int): the vina random seed.
+  @param boxes (list[dict] | None): the docking window of each job, see compute_boxes.
+  @param n_dockings (int): number of docking simulations.
+  @param mode (str): "dock" for a full docking, "optimize" for a cheap minimization score.
+  @param pocket_radius (float | None): if set, receptors are truncated to the residues within this distance of their box.
+  @param callback (callable): called with (index, score) each time a job is done.
+  @param poll (float): the seconds between two looks at the queue.
+  @param verbose (int): 0 for quiet, 1 for necessary information and 2 for debug.
+  @return (list[tuple[float, float, list[float]] | None]): the (deltaG, Kd, pose energies) of each job, in the jobs order, None if its docking failed.
+  """
+
+  callback = callback or (lambda i, score: None)
+  boxes = boxes or [None] * len(jobs)
+
+  pending = {}
+  for i, ((receptor, ligand), box) in enumerate(zip(jobs, boxes)):
+    task_id = work_queue.submit({"receptor_path": os.path.abspath(receptor), "ligand_path": os.path.abspath(ligand),
+      "seed": seed, "n_dockings": n_dockings, "box": box, "mode": mode, "pocket_radius": pocket_radius})
+    pending[task_id] = i
+
+  scores = [None] * len(jobs)
+  while pending:
+    # the tasks of dead workers are requeued even if no other worker polls
+    work_queue.reap()
+    for task_id in list(pending):
+      result = work_queue.result(task_id)
+      if result is None:
+        continue
+
+      i = pending.pop(task_id)
+      if "error" in result:
+        print(f"\t\terror simulating docking: {result['error']}")
+        scores[i] = None
+      else:
+        scores[i] = (result["delta_G"], result["Kd"], result.get("energies", [result["delta_G"]]))
+      callback(i, scores[i])
+
+    if pending:
+      time.sleep(poll)
+
+  return scores
+
+
+def timed_dock(function, *args, **kwargs) -> "tuple[tuple[float, float, list[float]], float]":
+  """
+  Runs dock() or dock_blocks() and measures how long the worker was busy with it.
+  @param function (callable): dock or dock_blocks.
+  @return (tuple[tuple[float, float, list[float]], float]): the (deltaG, Kd, pose energies) score and the duration in seconds.
+  """
+
+  start = time.perf_counter()
+  score = function(*args, **kwargs)
+  return score, time.perf_counter() - start
+
+
+class DockingPipeline:
+  def __init__(
+    self,
+    workers:int=1,
+    cpu:int=0,
+    seed:int=0,
+    cache:"DockingCache | None"=None,
+    queue_size:int=2,
+    scratch:"str | None"=None,
+    pocket_radius:"float | None"=None,
+    verbose:int=1):
+
+    """
+    A pool of docking processes fed while mutants are still being generated.
+    At most queue_size jobs wait for a free worker, submitting more blocks
+    the caller until one of them starts, which holds generation back.
+    @param workers (int): number of docking processes.
+    @param cpu (int): number of CPUs given to Vina in each worker (0 shares them evenly).
+    @param seed (int): the vina random seed.
+    @param cache (DockingCache | None): where previous docking results are looked up.
+    @param queue_size (int): number of jobs allowed to wait for a worker.
+    @param scratch (str | None): the node-local directory of the jobs submitted in memory.
+    @param pocket_radius (float | None): if set, receptors are truncated to the residues within this distance of their box.
+    @param verbose (int): 0 for quiet, 1 for necessary information and 2 for debug.
+    """
+
+    self.workers = max(1, workers)
+    self.cpu = cpu or max(1, multiprocessing.cpu_count() // self.workers)
+    self.seed = seed
+    self.cache = cache
+    self.scratch = scratch
+    self.pocket_radius = pocket_radius
+    self.verbose = verbose
+    self.slots = threading.BoundedSemaphore(self.workers + max(0, queue_size))
+    self.lock = threading.Lock()
+    self.blocked = 0.0
+    self.busy = 0.0
+
+
+  def __enter__(self) -> "DockingPipeline":
+    self.pool = docking_pool(self.workers)
+    self.start = time.perf_counter()
+    return self
+
+
+  def __exit__(self, *exc) -> None:
+    self.pool.shutdown(wait=True)
+
+
+  def submit(self, receptor_path:str, ligand_path:str) -> Future:
+    """
+    Queues a docking job, waiting first if the queue is full.
+    @param receptor_path (str): path to the receptor PDB file.
+    @param ligand_path (str): path to the ligand SDF file.
+    @return (Future): resolves to the (deltaG, Kd, pose energies) score of the job, None if its docking failed.
+    """
+
+    return self._submit(dock, receptor_path, ligand_path, self.cpu, self.seed, self.cache, 
+      pocket_radius=self.pocket_radius, verbose=self.verbose)
+
+
+  def submit_blocks(self, receptor_block:str, ligand_block:str) -> Future:
+    """
+    Queues a docking job from the contents of the receptor and ligand files, 
+    see dock_blocks, waiting first if the queue is full.
+    @param receptor_block (str): the content of the receptor PDB file.
+    @param ligand_block (str): the content of the ligand SDF file.
+    @return (Future): resolves to the (deltaG, Kd, pose energies) score of the job, None if its docking failed.
+    """
+
+    return self._submit(dock_blocks, receptor_block, ligand_block, self.cpu, self.seed, self.cache, 
+      scratch=self.scratch, pocket_radius=self.pocket_radius, verbose=self.verbose)
+
+
+  def utilization(self) -> "dict[str, float]":
+    """
+    Reports how the pipeline spent its time since it was opened.
+    @return (dict[str, float]): the wall time, the time submitters were blocked, 
+    the total docking time and the docking workers utilization (0 to 1).
+    """
+
+    wall = time.perf_counter() - self.start
+    return {
+      "wall": wall,
+      "blocked": self.blocked,
+      "docking_busy": self.busy,
+      "docking": self.busy / (wall * self.workers) if wall > 0 else 0.0
+    }
+
+
+  def _submit(self, function, *args, **kwargs) -> Future:
+    start = time.perf_counter()
+    self.slots.acquire()
+    self.blocked += time.perf_counter() - start
+
+    score = Future()
+    job = self.pool.submit(timed_dock, function, *args, **kwargs)
+    job.add_done_callback(lambda job: self._done(job, score))
+    return score
+
+
+  def _done(self, job:Future, score:Future) -> None:
+    self.slots.release()
+    if job.exception() is not None:
+      score.set_exception(job.exception())
+      return
+
+    result, seconds = job.result()
+    with self.lock:
+      self.busy += seconds
+    score.set_result(result)
@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import uuid
+import queue
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class Job:
+  def __init__(self, receptor:str, ligand:str, number:int, options:dict):
+    """
+    A generation and docking request, along with its progress and timings.
+    @param receptor (str): path to the receptor PDB file.
+    @param ligand (str): path to the ligand SDF file.
+    @param number (int): the number of mutants to generate.
+    @param options (dict): generation and docking options overriding the server defaults.
+    """
+
+    self.id = uuid.uuid4().hex[:12]
+    self.receptor = receptor
+    self.ligand = ligand
+    self.number = number
+    self.options = options
+    self.state = "queued"
+    self.run_dir = None
+    self.error = None
+    self.events = []
+    self.timings = {"submitted": time.time()}
+    self.changed = threading.Condition()
+
+
+  def event(self, stage:str, details:dict) -> None:
+    """
+    Appends a progress event and wakes up the clients streaming this job.
+    @param stage (str): the pipeline stage the event comes from.
+    @param details (dict): JSON-serializable event content.
+    """
+
+    with self.changed:
+      self.events.append({"time": time.time(), "stage": stage, **details})
+      self.changed.notify_all()
+
+
+  def finish(self, state:str, error:"str | None"=None) -> None:
+    """
+    Ends the job with its terminal event, so that streaming clients see the 
+    state change and the event at once.
+    @param state (str): "done" or "failed".
+    @param error (str | None): the error of a failed job.
+    """
+
+    with self.changed:
+      self.state = state
+      self.error = error
+      self.events.append({"time": time.time(), "stage": "job", "state": state, "error": error})
+      self.changed.notify_all()
+
+
+  def to_dict(self) -> dict:
+    return {
+      "id": self.id,
+      "state": self.state,
+      "receptor": self.receptor,
+      "ligand": self.ligand,
+      "number": self.number,
+      "options": self.options,
+      "run_dir": self.run_dir,
+      "error": self.error,
+      "timings": self.timings,
+      "events": len(self.events)
+    }
+
+
+class Server:
+  # options a job may override, mapped to Model attributes
+  OPTIONS = {"workers": "workers", "vina_cpu": "vina_cpu", "seed": "seed", "batch_size": "batch_size"}
+
+  def __init__(
+    self, 
+    model, 
+    host:str="127.0.0.1", 
+    port:int=8089, 
+    socket_path:"str | None"=None, 
+    history:int=1000):
+    """
+    Keeps one warm Model and runs the jobs submitted over HTTP, one at a time.
+    @param model (Model): the model, shared by every job.
+    @param host (str): the TCP interface to listen on.
+    @param port (int): the TCP port to listen on.
+    @param socket_path (str | None): listens on this Unix socket instead of TCP.
+    @param history (int): the number of finished jobs kept, the oldest ones are forgotten.
+    """
+
+    self.model = model
+    self.jobs = {}
+    self.lock = threading.Lock() # jobs are submitted and listed by concurrent requests
+    self.history = history
+    self.queue = queue.Queue()
+    self.current = None
+    self.defaults = {attr: getattr(model, attr) for attr in (*self.OPTIONS.values(), "size")}
+
+    handler = type("Handler", (_Handler,), {"server_state": self})
+    if socket_path is not None:
+      if os.path.exists(socket_path):
+        os.remove(socket_path)
+      self.httpd = _UnixHTTPServer(socket_path, handler)
+    else:
+      self.httpd = ThreadingHTTPServer((host, port), handler)
+
+
+  def submit(self, payload:dict) -> Job:
+    """
+    Validates a job request and appends it to the queue.
+    @param payload (dict): receptor, ligand, number and options.
+    @return (Job): the queued job.
+    """
+
+    for key in ("receptor", "ligand"):
+      if not os.path.isfile(payload.get(key, "")):
+        raise ValueError(f"{key} file not found: {payload.get(key)}")
+
+    options = {k: payload[k] for k in self.OPTIONS if k in payload}
+    if options.get("batch_size", "auto") != "auto" and not (isinstance(options["batch_size"], int) and options["batch_size"] >= 1):
+      raise ValueError(f"batch_size must be auto or a positive integer: {options['batch_size']}")
+    job = Job(payload["receptor"], payload["ligand"], int(payload.get("number", self.defaults["size"])), options)
+    with self.lock:
+      self.jobs[job.id] = job
+      finished = [key for key, other in self.jobs.items() if other.state in ("done", "failed")]
+      for key in finished[:max(0, len(finished) - self.history)]:
+        del self.jobs[key]
+    self.queue.put(job)
+    return job
+
+
+  def job(self, job_id:str) -> "Job | None":
+    """
+    @param job_id (str): the job id.
+    @return (Job | None): the job, None if unknown or forgotten.
+    """
+
+    with self.lock:
+      return self.jobs.get(job_id)
+
+
+  def list_jobs(self) -> "list[Job]":
+    """
+    @return (list[Job]): the known jobs, in submission order.
+    """
+
+    with self.lock:
+      return list(self.jobs.values())
+
+
+  def status(self) -> dict:
+    """
+    Summarizes the queue and the timings of the finished jobs.
+    @return (dict): queue depth, running job and mean stage durations.
+    """
+
+    jobs = self.list_jobs()
+    done = [job for job in jobs if job.state == "done"]
+    means = {}
+    for stage in ("wait", "input", "generate", "results", "total"):
+      values = [job.timings[stage] for job in done if stage in job.timings]
+      means[stage] = sum(values) / len(values) if values else None
+
+    return {
+      "queue_depth": self.queue.qsize(),
+      "running": self.current.id if self.current else None,
+      "jobs": {state: sum(job.state == state for job in jobs)
+        for state in ("queued", "running", "done", "failed")},
+      "mean_timings": means
+    }
+
+
+  def serve_forever(self) -> None:
+    """
+    Starts the inference thread, then answers requests until interrupted.
+    """
+
+    threading.Thread(target=self._work, daemon=True).start()
+    try:
+      self.httpd.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      self.httpd.server_close()
+
+
+  def _work(self) -> None:
+    """
+    Runs the queued jobs in order on the warm model.
+    """
+
+    while True:
+      job = self.queue.get()
+      self.current = job
+      self._run(job)
+      self.current = None
+      self.queue.task_done()
+
+
+  def _run(self, job:Job) -> None:
+    """
+    Runs a single job, recording the duration of each stage.
+    @param job (Job): the job to run.
+    """
+
+    start = time.time()
+    job.timings["wait"] = start - job.timings["submitted"]
+    job.state = "running"
+    job.event("job", {"state": job.state})
+
+    # per job settings are restored to the server defaults afterwards
+    for key, attr in self.OPTIONS.items():
+      setattr(self.model, attr, job.options.get(key, self.defaults[attr]))
+    self.model.size = job.number
+    self.model.progress = job.event
+
+    state, error = "failed", None
+    try:
+      for stage, call in (
+        ("input", lambda: self.model.input(job.receptor, job.ligand)),
+        ("generate", lambda: self.model.generate()),
+        ("results", lambda: self.model.results([self.model.run_dir]))
+      ):
+        t = time.time()
+        call()
+        job.timings[stage] = time.time() - t
+        job.event(stage, {"seconds": job.timings[stage]})
+      job.run_dir = self.model.run_dir
+      state = "done"
+    except Exception as e:
+      error = str(e)
+    finally:
+      self.model.progress = None
+      for attr, value in self.defaults.items():
+        setattr(self.model, attr, value)
+      job.timings["total"] = time.time() - start
+      job.finish(state, error)
+
+
+class _Handler(BaseHTTPRequestHandler):
+  server_state = None # the Server instance, set by Server.__init__
+
+  def do_POST(self):
+    if self.path.rstrip("/") != "/jobs":
+      return self._reply(404, {"error": "not found"})
+
+    try:
+      payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+      if not isinstance(payload, dict):
+        raise ValueError("the job must be a JSON object")
+      job = self.server_state.submit(payload)
+    except (ValueError, TypeError) as e:
+      return self._reply(400, {"error": str(e)})
+    self._reply(202, job.to_dict())
+
+
+  def do_GET(self):
+    parts = [part for part in self.path.split("/") if part]
+
+    if parts == ["status"]:
+      return self._reply(200, self.server_state.status())
+    if parts == ["jobs"]:
+      return self._reply(200, [job.to_dict() for job in self.server_state.list_jobs()])
+    job = self.server_state.job(parts[1]) if len(parts) in (2, 3) and parts[0] == "jobs" else None
+    if job is not None:
+      if len(parts) == 2:
+        return self._reply(200, job.to_dict())
+      if parts[2] == "events":
+        return self._stream(job)
+    self._reply(404, {"error": "not found"})
+
+
+  def _stream(self, job:Job) -> None:
+    """
+    Streams the job events as JSON lines until the job is over.
+    @param job (Job): the followed job.
+    """
+
+    self.send_response(200)
+    self.send_header("Content-Type", "application/x-ndjson")
+    self.end_headers()
+
+    sent = 0
+    while True:
+      with job.changed:
+        while sent == len(job.events) and job.state in ("queued", "running"):
+          job.changed.wait(timeout=30)
+        events = job.events[sent:]
+        over = job.state not in ("queued", "running") and sent + len(events) == len(job.events)
+
+      for event in events:
+        self.wfile.write((json.dumps(event) + "\n").encode())
+      self.wfile.flush()
+      sent += len(events)
+
+      if over:
+        break
+
+
+  def _reply(self, code:int, body) -> None:
+    data = json.dumps(body).encode()
+    self.send_response(code)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+
+  def address_string(self) -> str:
+    # Unix socket clients have no (host, port) address
+    return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+
+  def log_message(self, format, *args):
+    if self.server_state.model.verbose == 2:
+      super().log_message(format, *args)
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+try:
+  import resource
+except ImportError: # not available on Windows
+  resource = None
+
+# spawned docking workers find the tracing setup of their parent in these
+TRACE_ENV = "FLINT_TRACE"
+PROFILE_ENV = "FLINT_PROFILE"
+
+def peak_rss() -> float:
+  """
+  Returns the peak resident set size of the current process.
+  @return (float): the peak RSS in megabytes, 0 when it cannot be measured.
+  """
+
+  if resource is None:
+    return 0.0
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kilobytes on linux
+
+
+def current_rss() -> float:
+  """
+  Returns the resident set size of the current process.
+  @return (float): the RSS in megabytes, 0 when it cannot be measured.
+  """
+
+  try:
+    with open("/proc/self/statm", "r") as file:
+      return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+  except (OSError, ValueError, IndexError): # not on linux
+    return 0.0
+
+
+def peak_device_memory() -> float:
+  """
+  Returns the peak memory allocated by torch on the current CUDA device, 
+  since the last reset_peak_device_memory().
+  @return (float): the peak allocation in megabytes, 0 without torch or CUDA.
+  """
+
+  cuda = _cuda()
+  return 0.0 if cuda is None else cuda.max_memory_allocated() / 2 ** 20
+
+
+def reset_peak_device_memory() -> None:
+  """
+  Restarts the measure of peak_device_memory(), if CUDA is in use.
+  """
+
+  cuda = _cuda()
+  if cuda is not None:
+    cuda.reset_peak_memory_stats()
+
+
+def _cuda():
+  # docking workers never import torch, it is not imported for them here
+  torch = sys.modules.get("torch")
+  if torch is None or not torch.cuda.is_available() or not torch.cuda.is_initialized():
+    return None
+  return torch.cuda
+
+
+class Tracer:
+  def __init__(self, log_path:"str | None"=None, profile_dir:"str | None"=None, keep:int=10000):
+    """
+    Records the wall time, CPU time, RSS and peak device memory of named
+    stages of the pipeline. Each span is appended to a JSON-lines log as soon
+    as it ends, and stages opened with profile=True are run under cProfile.
+    The device peak is the one of the stage, nested stages included. The peak 
+    RSS is the high-water mark of the process, which the system cannot reset, 
+    so the RSS at the start and end of each stage is recorded as well.
+    @param log_path (str | None): the JSON-lines log, shared with the docking workers.
+    @param profile_dir (str | None): where the cProfile statistics of each stage are dumped.
+    @param keep (int): the number of spans kept in memory for report().
+    """
+
+    self.log_path = log_path
+    self.profile_dir = profile_dir
+    self.spans = deque(maxlen=keep)
+    self.lock = threading.Lock()
+    self.profiles = {}
+    self.profiling = False
+    self.local = threading.local()
+
+    for path in (log_path and os.path.dirname(os.path.abspath(log_path)), profile_dir):
+      if path:
+        os.makedirs(path, exist_ok=True)
+
+
+  @contextmanager
+  def span(self, name:str, profile:bool=False, **attrs):
+    """
+    Measures the block it wraps and stores it under a name.
+    @param name (str): the name of the stage.
+    @param profile (bool): whether the block is run under cProfile when profiling is enabled.
+    @param attrs: JSON-serializable details of the span (batch size, run...).
+    """
+
+    # the device peak restarts with each stage, the stage around it keeps its own
+    stack = self.local.__dict__.setdefault("stack", [])
+    if stack:
+      stack[-1]["device"] = max(stack[-1]["device"], peak_device_memory())
+    reset_peak_device_memory()
+    stack.append({"device": 0.0})
+
+    profiler = self._start_profile(name) if profile else None
+    rss = current_rss()
+    start, wall, cpu = time.time(), time.perf_counter(), time.process_time()
+    try:
+      yield attrs
+    finally:
+      wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+      device = max(stack.pop()["device"], peak_device_memory())
+      if stack:
+        stack[-1]["device"] = max(stack[-1]["device"], device)
+      self.add(name, start, wall, cpu, rss_start=rss, peak_device=device, **attrs)
+      if profiler is not None:
+        self._stop_profile(name, profiler)
+
+
+  def add(
+    self, 
+    name:str, 
+    start:float, 
+    wall:float, 
+    cpu:"float | None"=None, 
+    rss_start:"float | None"=None, 
+    peak_device:"float | None"=None, 
+    **attrs) -> None:
+    """
+    Stores a span measured elsewhere.
+    @param name (str): the name of the stage.
+    @param start (float): the span start, as a time.time() timestamp.
+    @param wall (float): the span duration in seconds.
+    @param cpu (float | None): the CPU time of the process during the span, in seconds.
+    @param rss_start (float | None): the RSS at the span start, in megabytes, if measured.
+    @param peak_device (float | None): the peak device memory of the span, in megabytes, the current peak if None.
+    @param attrs: JSON-serializable details of the span.
+    """
+
+    span = {
+      "name": name,
+      "start": start,
+      "wall": wall,
+      "cpu": cpu,
+      "rss_start": rss_start,
+      "rss_end": current_rss(),
+      "peak_rss": peak_rss(),
+      "peak_device_memory": peak_device_memory() if peak_device is None else peak_device,
+      "pid": os.getpid(),
+      "tid": threading.get_ident(),
+      **({"attrs": attrs} if attrs else {})
+    }
+
+    with self.lock:
+      self.spans.append(span)
+      if self.log_path is not None:
+        with open(self.log_path, "a") as file:
+          file.write(json.dumps(span) + "\n")
+
+
+  def install(self) -> "Tracer":
+    """
+    Makes this tracer the one returned by current(), here and in the docking
+    workers spawned from now on.
+    @return (Tracer): the instance of Tracer, for chainability purposes.
+    """
+
+    global _current
+    _current = self
+    for key, value in ((TRACE_ENV, self.log_path), (PROFILE_ENV, self.profile_dir)):
+      if value:
+        os.environ[key] = os.path.abspath(value)
+      else:
+        os.environ.pop(key, None)
+    return self
+
+
+  def report(self, stages:"tuple[str] | None"=None) -> str:
+    """
+    Formats the recorded stages as a table.
+    @param stages (tuple[str] | None): the names of the stages reported, all of them if None.
+    @return (str): one line per stage, with its wall and CPU times, its RSS at start and end, 
+    the peak RSS of the process and the peak device memory of the stage.
+    """
+
+    lines = [f"{'stage':<24}{'wall (s)':>12}{'cpu (s)':>12}{'RSS start (MB)':>16}{'RSS end (MB)':>14}"
+      f"{'peak RSS (MB)':>16}{'peak device (MB)':>18}"]
+    for span in self.spans:
+      if stages is not None and span["name"] not in stages:
+        continue
+      cpu = "-" if span["cpu"] is None else f"{span['cpu']:.3f}"
+      rss_start = "-" if span["rss_start"] is None else f"{span['rss_start']:.1f}"
+      lines.append(f"{span['name']:<24}{span['wall']:>12.3f}{cpu:>12}{rss_start:>16}{span['rss_end']:>14.1f}"
+        f"{span['peak_rss']:>16.1f}{span['peak_device_memory']:>18.1f}")
+    return "\n".join(lines)
+
+
+  def _start_profile(self, name:str) -> "cProfile.Profile | None":
+    # a single profiler can run at once, nested stages are part of the outer one
+    with self.lock:
+      if self.profile_dir is None or self.profiling:
+        return None
+      self.profiling = True
+      profiler = self.profiles.setdefault(name, cProfile.Profile())
+    profiler.enable()
+    return profiler
+
+
+  def _stop_profile(self, name:str, profiler:cProfile.Profile) -> None:
+    profiler.disable()
+    # statistics accumulate over every span of the stage, in each process
+    profiler.dump_stats(os.path.join(self.profile_dir, f"{name}.{os.getpid()}.prof"))
+    with self.lock:
+      self.profiling = False
+
+
+_current = None
+
+def current() -> Tracer:
+  """
+  Returns the tracer of this process : the installed one, or in a docking
+  worker, one that logs and profiles where its parent does.
+  @return (Tracer): the process tracer.
+  """
+
+  global _current
+  if _current is None:
+    _current = Tracer(os.environ.get(TRACE_ENV), os.environ.get(PROFILE_ENV), keep=0)
+  return _current
+
+
+def export_chrome(log_path:str, trace_path:str) -> None:
+  """
+  Converts a JSON-lines span log into a Chrome trace, readable by
+  chrome://tracing and Perfetto, with one track per process and thread.
+  @param log_path (str): the log written by Tracer.
+  @param trace_path (str): the trace file (.json).
+  """
+
+  events = []
+  with open(log_path, "r") as file:
+    for line in file:
+      try:
+        span = json.loads(line)
+      except json.JSONDecodeError:
+        continue
+      events.append({
+        "name": span["name"],
+        "ph": "X",
+        "ts": span["start"] * 1e6,
+        "dur": span["wall"] * 1e6,
+        "pid": span["pid"],
+        "tid": span["tid"],
+        "args": {**{key: span.get(key) for key in ("cpu", "rss_start", "rss_end", "peak_rss", "peak_device_memory")}, **span.get("attrs", {})}
+      })
+
+  with open(trace_path, "w") as file:
+    json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+
+class WorkQueue:
+  def __init__(self, directory:str, lease:float=300, max_attempts:int=3):
+    """
+    Docking tasks shared through a directory, so that workers on other nodes
+    can score the mutants of a run. A task goes from pending/ to leased/ when a
+    worker claims it, with an atomic rename, then its result is written to
+    done/ (or failed/). Workers refresh the modification time of their leased
+    task while it runs, and a task whose lease expired is put back in pending/
+    by anyone polling the queue. Collected results leave a marker in 
+    collected/, so that a copy requeued meanwhile is not docked again.
+    @param directory (str): the queue directory, on a filesystem shared by the nodes.
+    @param lease (float): the seconds a claimed task may go without a heartbeat.
+    @param max_attempts (int): the number of claims of a task before it is failed.
+    """
+
+    self.directory = directory
+    self.lease = lease
+    self.max_attempts = max_attempts
+    for state in ("pending", "leased", "done", "failed", "collected"):
+      os.makedirs(os.path.join(directory, state), exist_ok=True)
+
+
+  def submit(self, task:dict) -> str:
+    """
+    Adds a task to the queue.
+    @param task (dict): JSON-serializable docking arguments.
+    @return (str): the task id.
+    """
+
+    task_id = uuid.uuid4().hex
+    self._write("pending", task_id, {"id": task_id, "attempts": 0, "task": task})
+    return task_id
+
+
+  def claim(self) -> "dict | None":
+    """
+    Leases the oldest pending task.
+    @return (dict | None): the task entry (id, attempts, task), None if the queue is empty.
+    """
+
+    pending = os.path.join(self.directory, "pending")
+    entries = sorted(os.scandir(pending), key=lambda entry: _mtime(entry.path))
+    for entry in entries:
+      if not entry.name.endswith(".json"):
+        continue
+
+      # the lease starts now, the rename keeps the modification time
+      try:
+        os.utime(entry.path)
+        os.rename(entry.path, self._path("leased", entry.name[:-5]))
+      except FileNotFoundError: # claimed by another worker
+        continue
+
+      task = self._read("leased", entry.name[:-5])
+      if task is None:
+        continue
+
+      # a task requeued while its first worker was finishing is already done
+      if os.path.isfile(self._path("done", task["id"])) or os.path.isfile(self._path("collected", task["id"])):
+        self._remove("leased", task["id"])
+        continue
+      return task
+
+    return None
+
+
+  def heartbeat(self, task_id:str) -> None:
+    """
+    Extends the lease of a claimed task.
+    @param task_id (str): the task id.
+    """
+
+    try:
+      os.utime(self._path("leased", task_id))
+    except FileNotFoundError: # requeued, the result is still accepted
+      pass
+
+
+  def complete(self, task_id:str, result:dict) -> None:
+    """
+    Writes the result of a task and releases its lease.
+    @param task_id (str): the task id.
+    @param result (dict): JSON-serializable result.
+    """
+
+    # the result of a requeued copy may have been collected already
+    if not os.path.isfile(self._path("collected", task_id)):
+      self._write("done", task_id, result)
+    self._remove("leased", task_id)
+
+
+  def fail(self, task_id:str, error:str) -> None:
+    """
+    Records the error of a task, which is put back in the queue until its
+    attempts are exhausted.
+    @param task_id (str): the task id.
+    @param error (str): the error message.
+    """
+
+    self._requeue(task_id, error)
+
+
+  def result(self, task_id:str) -> "dict | None":
+    """
+    Collects the result of a task, removing it from the queue.
+    @param task_id (str): the task id.
+    @return (dict | None): the result, {"error": ...} if the task failed, None if it is not over.
+    """
+
+    for state in ("done", "failed"):
+      result = self._read(state, task_id)
+      if result is not None:
+        self._write("collected", task_id, {})
+        self._remove(state, task_id)
+        self._remove("pending", task_id)
+        return result if state == "done" else {"error": result.get("error")}
+    return None
+
+
+  def reap(self) -> int:
+    """
+    Puts the tasks whose lease expired back in the queue, and forgets the 
+    collected tasks that have no copy left in it.
+    @return (int): the number of requeued tasks.
+    """
+
+    expired = 0
+    for entry in os.scandir(os.path.join(self.directory, "leased")):
+      if entry.name.endswith(".json") and time.time() - _mtime(entry.path) > self.lease:
+        expired += self._requeue(entry.name[:-5], "lease expired")
+
+    # a requeued copy is in pending/ or leased/ at any time, see _requeue
+    for entry in os.scandir(os.path.join(self.directory, "collected")):
+      task_id = entry.name[:-5]
+      if (entry.name.endswith(".json") and time.time() - _mtime(entry.path) > self.lease
+        and not any(os.path.isfile(self._path(state, task_id)) for state in ("pending", "leased"))):
+        self._remove("collected", task_id)
+    return expired
+
+
+  def counts(self) -> "dict[str, int]":
+    return {state: sum(1 for name in os.listdir(os.path.join(self.directory, state)) if name.endswith(".json"))
+      for state in ("pending", "leased", "done", "failed")}
+
+
+  def _requeue(self, task_id:str, error:str) -> bool:
+    task = self._read("leased", task_id)
+    if task is None: # requeued or completed meanwhile
+      return False
+
+    task["attempts"] += 1
+    task["error"] = error
+    if task["attempts"] >= self.max_attempts:
+      self._write("failed", task_id, task)
+    else:
+      self._write("pending", task_id, task)
+    self._remove("leased", task_id)
+    return True
+
+
+  def _path(self, state:str, task_id:str) -> str:
+    return os.path.join(self.directory, state, f"{task_id}.json")
+
+
+  def _write(self, state:str, task_id:str, content:dict) -> None:
+    # write then rename, so that no one reads half a task
+    tmp = os.path.join(self.directory, state, f".{task_id}.{socket.gethostname()}.{os.getpid()}.tmp")
+    with open(tmp, "w") as file:
+      json.dump(content, file)
+    os.replace(tmp, self._path(state, task_id))
+
+
+  def _read(self, state:str, task_id:str) -> "dict | None":
+    try:
+      with open(self._path(state, task_id), "r") as file:
+        return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+      return None
+
+
+  def _remove(self, state:str, task_id:str) -> None:
+    try:
+      os.remove(self._path(state, task_id))
+    except FileNotFoundError:
+      pass
+
+
+def _mtime(path:str) -> float:
+  try:
+    return os.path.getmtime(path)
+  except FileNotFoundError:
+    return 0.0
+
+
+def work(
+  work_queue:WorkQueue,
+  cpu:int=0,
+  cache=None,
+  idle:float=0,
+  poll:float=1.0,
+  verbose:int=1) -> int:
+
+  """
+  Claims and docks the tasks of a queue until it stays empty for idle seconds.
+  @param work_queue (WorkQueue): the queue.
+  @param cpu (int): number of CPUs given to Vina (0 uses all of them).
+  @param cache (DockingCache | None): where previous docking results are looked up.
+  @param idle (float): the seconds without tasks before returning, 0 never returns.
+  @param poll (float): the seconds between two looks at an empty queue.
+  @param verbose (int): 0 for quiet, 1 for necessary information and 2 for debug.
+  @return (int): the number of docked tasks.
+  """
+
+  from .scoring import dock
+
+  worker = f"{socket.gethostname()}:{os.getpid()}"
+  docked = 0
+  waiting = time.time()
+
+  while not idle or time.time() - waiting < idle:
+    work_queue.reap()
+    task = work_queue.claim()
+    if task is None:
+      time.sleep(poll)
+      continue
+
+    # the lease is kept alive while vina runs
+    stop = threading.Event()
+    def beat(task_id=task["id"]):
+      while not stop.wait(work_queue.lease / 3):
+        work_queue.heartbeat(task_id)
+    threading.Thread(target=beat, daemon=True).start()
+
+    start = time.time()
+    try:
+      # a failed docking is retried by another claim, until its attempts are exhausted
+      score = dock(**task["task"], cpu=cpu, cache=cache, raise_errors=True, verbose=verbose)
+      work_queue.complete(task["id"], {"delta_G": float(score[0]), "Kd": float(score[1]), "energies": score[2],
+        "worker": worker, "seconds": time.time() - start})
+      docked += 1
+
+      if verbose > 0:
+        print(f"\t{worker} docked {task['task']['receptor_path']} in {time.time() - start:.1f}s.")
+    except Exception as e:
+      work_queue.fail(task["id"], f"{worker}: {e}")
+    finally:
+      stop.set()
+    waiting = time.time()
+
+  return docked